@@ -44,7 +44,6 @@ import { useAuth } from "@/components/auth-provider"
 import { Loading } from "@/components/loading"
 
 // Import the fal.ai storage utilities
-import { uploadToFalStorage } from "@/lib/fal-storage"
 
 export default function ProfilePage() {
   const router = useRouter()
@@ -53,6 +52,12 @@ export default function ProfilePage() {
   const [savedImagesState, setSavedImagesState] = useState<any[]>([])
   const [lovedImagesState, setLovedImagesState] = useState<any[]>([])
   const [historyImagesState, setHistoryImagesState] = useState<any[]>([])
+  const [nextCursors, setNextCursors] = useState<Record<string, string | null>>({
+    loved: null,
+    saved: null,
+    history: null,
+  })
+  const [loadingMoreTab, setLoadingMoreTab] = useState<string | null>(null)
   const [userProfileState, setUserProfileState] = useState<any>({
     name: "",
     email: "",
@@ -156,7 +161,7 @@ export default function ProfilePage() {
           const updatedProfile = {
             name: response.user.name,
             email: response.user.email,
-            avatarUrl: response.user.avatar_url || "/placeholder.svg",
+            avatarUrl: apiClient.resolveUrl(response.user.avatar_url || "/placeholder.svg"),
             role: response.user.role,
           };
     
@@ -177,72 +182,44 @@ export default function ProfilePage() {
     fetchUserData()
   }, [memoizedUpdateUserProfile])
 
-  // In the useEffect for fetching images
-  useEffect(() => {
-    const fetchImages = async () => {
-      try {
-        // Add error handling for each API call
-        try {
-          const lovedResponse = await apiClient.getImages("loved")
-          if (lovedResponse.success) {
-            setLovedImagesState(
-              lovedResponse.images.map((img: any) => ({
-                id: img.id,
-                imageUrl: img.image_url,
-                prompt: img.prompt,
-                createdAt: img.created_at,
-              })),
-            )
-          } else {
-            console.error("Failed to fetch loved images:", lovedResponse.message)
-          }
-        } catch (error) {
-          console.error("Error fetching loved images:", error)
-        }
-
-        try {
-          const savedResponse = await apiClient.getImages("saved")
-          if (savedResponse.success) {
-            setSavedImagesState(
-              savedResponse.images.map((img: any) => ({
-                id: img.id,
-                imageUrl: img.image_url,
-                prompt: img.prompt,
-                createdAt: img.created_at,
-              })),
-            )
-          } else {
-            console.error("Failed to fetch saved images:", savedResponse.message)
-          }
-        } catch (error) {
-          console.error("Error fetching saved images:", error)
-        }
-
-        try {
-          const historyResponse = await apiClient.getImages()
-          if (historyResponse.success) {
-            setHistoryImagesState(
-              historyResponse.images.map((img: any) => ({
-                id: img.id,
-                imageUrl: img.image_url,
-                prompt: img.prompt,
-                createdAt: img.created_at,
-              })),
-            )
-          } else {
-            console.error("Failed to fetch history images:", historyResponse.message)
-          }
-        } catch (error) {
-          console.error("Error fetching history images:", error)
-        }
-      } catch (error) {
-        console.error("Failed to fetch images:", error)
+  // Fetch one page of a tab's images, appending it when following a cursor
+  const fetchImagePage = useCallback(async (tab: "loved" | "saved" | "history", cursor?: string) => {
+    const setImages = { loved: setLovedImagesState, saved: setSavedImagesState, history: setHistoryImagesState }[tab]
+    if (cursor) setLoadingMoreTab(tab)
+    try {
+      const response = await apiClient.getImages(tab === "history" ? "all" : tab, cursor)
+      if (response.success) {
+        const images = response.images.map((img: any) => ({
+          id: img.id,
+          imageUrl: img.image_url,
+          srcset: apiClient.resolveSrcSet(img.srcset),
+          prompt: img.prompt,
+          createdAt: img.created_at,
+        }))
+        // An image loved or saved here since the last page may be in this one too
+        setImages((prevImages: any[]) =>
+          cursor
+            ? [...prevImages, ...images.filter((image: any) => !prevImages.some((prev) => prev.id === image.id))]
+            : images,
+        )
+        setNextCursors((prevCursors) => ({ ...prevCursors, [tab]: response.next_cursor ?? null }))
+      } else {
+        console.error(`Failed to fetch ${tab} images:`, response.message)
       }
+    } catch (error) {
+      console.error(`Error fetching ${tab} images:`, error)
+    } finally {
+      if (cursor) setLoadingMoreTab(null)
     }
-
-    fetchImages()
   }, [])
 
+  // Only the first page of each tab; more pages load on request
+  useEffect(() => {
+    fetchImagePage("loved")
+    fetchImagePage("saved")
+    fetchImagePage("history")
+  }, [fetchImagePage])
+
   const handleDownload = async (imageUrl: string) => {
     try {
       const response = await fetch(imageUrl, { mode: "cors" }); // Ensure CORS is allowed
@@ -432,17 +409,12 @@ export default function ProfilePage() {
 
     if (file) {
       try {
-        // First, upload the file to fal.ai storage
-        const falUrl = await uploadToFalStorage(file)
-        userProfileState.avtarUrl = falUrl;
-
-        // Update backend with the fal.ai URL
-        const response = await apiClient.updateProfile({ avatarUrl: falUrl })
+        // The backend validates, resizes and stores the image
+        const response = await apiClient.uploadAvatar(file)
 
         if (response.success) {
           // Update local state with the URL returned from the server
-          const serverAvatarUrl = response.user.avatar_url || falUrl
-          memoizedUpdateUserProfile({ avatarUrl: serverAvatarUrl })
+          memoizedUpdateUserProfile({ avatarUrl: apiClient.resolveUrl(response.user.avatar_url) })
 
           toast({
             title: "Profile Updated",
@@ -630,15 +602,15 @@ export default function ProfilePage() {
             <TabsList className="grid w-full grid-cols-4">
               <TabsTrigger value="loved" className="flex gap-2">
                 <Heart className="h-4 w-4" />
-                Loved ({lovedImagesState.length})
+                Loved ({lovedImagesState.length}{nextCursors.loved ? "+" : ""})
               </TabsTrigger>
               <TabsTrigger value="saved" className="flex gap-2">
                 <Bookmark className="h-4 w-4" />
-                Saved ({savedImagesState.length})
+                Saved ({savedImagesState.length}{nextCursors.saved ? "+" : ""})
               </TabsTrigger>
               <TabsTrigger value="history" className="flex gap-2">
                 <History className="h-4 w-4" />
-                History ({historyImagesState.length})
+                History ({historyImagesState.length}{nextCursors.history ? "+" : ""})
               </TabsTrigger>
               <TabsTrigger value="settings" className="flex gap-2">
                 <Settings className="h-4 w-4" />
@@ -660,7 +632,10 @@ export default function ProfilePage() {
                       <div className="aspect-square w-full bg-muted">
                         <img
                           src={image.imageUrl || "/placeholder.svg"}
+                          srcSet={image.srcset}
+                          sizes="(min-width: 1024px) 33vw, (min-width: 640px) 50vw, 100vw"
                           alt={image.prompt}
+                          loading="lazy"
                           className="h-full w-full object-cover"
                         />
                       </div>
@@ -711,6 +686,17 @@ export default function ProfilePage() {
                   ))}
                 </div>
               )}
+              {nextCursors.loved && (
+                <div className="mt-6 flex justify-center">
+                  <Button
+                    variant="outline"
+                    onClick={() => fetchImagePage("loved", nextCursors.loved ?? undefined)}
+                    disabled={loadingMoreTab === "loved"}
+                  >
+                    {loadingMoreTab === "loved" ? "Loading..." : "Load more"}
+                  </Button>
+                </div>
+              )}
             </TabsContent>
 
             <TabsContent value="saved" className="mt-6">
@@ -727,7 +713,10 @@ export default function ProfilePage() {
                       <div className="aspect-square w-full bg-muted">
                         <img
                           src={image.imageUrl || "/placeholder.svg"}
+                          srcSet={image.srcset}
+                          sizes="(min-width: 1024px) 33vw, (min-width: 640px) 50vw, 100vw"
                           alt={image.prompt}
+                          loading="lazy"
                           className="h-full w-full object-cover"
                         />
                       </div>
@@ -778,6 +767,17 @@ export default function ProfilePage() {
                   ))}
                 </div>
               )}
+              {nextCursors.saved && (
+                <div className="mt-6 flex justify-center">
+                  <Button
+                    variant="outline"
+                    onClick={() => fetchImagePage("saved", nextCursors.saved ?? undefined)}
+                    disabled={loadingMoreTab === "saved"}
+                  >
+                    {loadingMoreTab === "saved" ? "Loading..." : "Load more"}
+                  </Button>
+                </div>
+              )}
             </TabsContent>
 
             <TabsContent value="history" className="mt-6">
@@ -794,7 +794,10 @@ export default function ProfilePage() {
                       <div className="aspect-square w-full bg-muted">
                         <img
                           src={image.imageUrl || "/placeholder.svg"}
+                          srcSet={image.srcset}
+                          sizes="(min-width: 1024px) 33vw, (min-width: 640px) 50vw, 100vw"
                           alt={image.prompt}
+                          loading="lazy"
                           className="h-full w-full object-cover"
                         />
                       </div>
@@ -868,6 +871,17 @@ export default function ProfilePage() {
                   ))}
                 </div>
               )}
+              {nextCursors.history && (
+                <div className="mt-6 flex justify-center">
+                  <Button
+                    variant="outline"
+                    onClick={() => fetchImagePage("history", nextCursors.history ?? undefined)}
+                    disabled={loadingMoreTab === "history"}
+                  >
+                    {loadingMoreTab === "history" ? "Loading..." : "Load more"}
+                  </Button>
+                </div>
+              )}
             </TabsContent>
 
             <TabsContent value="settings" className="mt-6">
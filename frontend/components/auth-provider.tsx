@@ -65,7 +65,7 @@ export function AuthProvider({ children }: { children: React.ReactNode }) {
             updateUserProfile({
               name: response.user.name,
               email: response.user.email,
-              avatarUrl: response.user.avatar_url || "/placeholder.svg",
+              avatarUrl: apiClient.resolveUrl(response.user.avatar_url || "/placeholder.svg"),
               role: response.user.role,
             })
 
@@ -4,6 +4,9 @@ class ApiClient {
   private baseUrl: string = process.env.NEXT_PUBLIC_API_URL || "http://localhost:5000"
   private retryCount = 3
   private retryDelay = 1000 // 1 second
+  // Read-your-writes deadline from the last response that wrote; echoed back
+  // so our reads skip the database replica until it passes
+  private primaryUntil: string | null = null
 
   constructor() {
     // Initialize token from localStorage if available
@@ -29,6 +32,20 @@ class ApiClient {
     }
   }
 
+  // Resolve a URL served by the backend (e.g. /api/images/assets/...) against the API base URL
+  resolveUrl(url: string) {
+    return url.startsWith("/api/") ? this.baseUrl + url : url
+  }
+
+  // Resolve the backend-relative URLs in a srcset against the API base URL
+  resolveSrcSet(srcset?: string | null) {
+    if (!srcset) return undefined
+    return srcset
+      .split(", ")
+      .map((candidate) => this.resolveUrl(candidate))
+      .join(", ")
+  }
+
   // Get the headers for API requests
   private getHeaders() {
     const headers: Record<string, string> = {
@@ -40,13 +57,24 @@ class ApiClient {
       headers["Authorization"] = `Bearer ${this.token}`
     }
 
+    if (this.primaryUntil) {
+      headers["X-Primary-Until"] = this.primaryUntil
+    }
+
     return headers
   }
 
+  // Remember a response's read-your-writes deadline, if it set one
+  private trackPrimaryUntil(response: Response) {
+    const until = response.headers.get("X-Primary-Until")
+    if (until) this.primaryUntil = until
+  }
+
   // Helper function to retry a fetch request
   private async retryFetch(url: string, options: RequestInit, attempt = 1): Promise<Response> {
     try {
       const response = await fetch(url, options)
+      this.trackPrimaryUntil(response)
       return response
     } catch (error) {
       if (attempt >= this.retryCount) {
@@ -319,6 +347,39 @@ class ApiClient {
     }
   }
 
+  // Upload a new avatar image as multipart/form-data
+  async uploadAvatar(file: File) {
+    const body = new FormData()
+    body.append("avatar", file)
+    try {
+      // Let the browser set the multipart Content-Type and boundary
+      const headers: Record<string, string> = this.token ? { Authorization: `Bearer ${this.token}` } : {}
+      if (this.primaryUntil) headers["X-Primary-Until"] = this.primaryUntil
+      const response = await fetch(`${this.baseUrl}/api/user/avatar`, {
+        method: "POST",
+        headers,
+        body,
+      })
+      this.trackPrimaryUntil(response)
+      const contentType = response.headers.get("content-type")
+      if (contentType && contentType.includes("application/json")) {
+        return await response.json()
+      }
+      return {
+        success: false,
+        message: `HTTP error ${response.status}: ${response.statusText}`,
+        status: response.status,
+      }
+    } catch (error) {
+      console.error(`Error uploading avatar:`, error)
+      return {
+        success: false,
+        message: "Network or parsing error",
+        error: error instanceof Error ? error.message : String(error),
+      }
+    }
+  }
+
   async updatePassword(currentPassword: string, newPassword: string) {
     return this.put("/api/user/password", { currentPassword, newPassword })
   }
@@ -328,9 +389,13 @@ class ApiClient {
   }
 
   // Image methods
-  async getImages(filter?: "all" | "loved" | "saved") {
-    const url = filter && filter !== "all" ? `/api/images?filter=${filter}` : "/api/images"
-    return this.get(url)
+  async getImages(filter?: "all" | "loved" | "saved", cursor?: string, limit?: number) {
+    const params = new URLSearchParams()
+    if (filter && filter !== "all") params.set("filter", filter)
+    if (cursor) params.set("cursor", cursor)
+    if (limit) params.set("limit", String(limit))
+    const query = params.toString()
+    return this.get(query ? `/api/images?${query}` : "/api/images")
   }
 
   async getImage(id: string) {
@@ -356,6 +421,66 @@ class ApiClient {
   async generateImage(prompt: string) {
     return this.post("/api/images/generate", { prompt })
   }
+
+  async getPredefinedImages() {
+    return this.get("/api/images/predefined")
+  }
+
+  async getPredefinedImageStatuses(imageUrls: string[]) {
+    return this.post("/api/images/predefined/status", { imageUrls })
+  }
+
+  async getGenerationJob(jobId: string) {
+    return this.get(`/api/images/generate/${jobId}`)
+  }
+
+  // Stream a generation job's progress; resolves with the final job status
+  async streamGenerationJob(jobId: string, onEvent: (type: string, data: any) => void) {
+    const response = await fetch(`${this.baseUrl}/api/images/generate/${jobId}/events`, {
+      method: "GET",
+      headers: { ...this.getHeaders(), Accept: "text/event-stream" },
+    })
+
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP error ${response.status}: ${response.statusText}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ""
+    let status: any = null
+
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      // Messages are separated by a blank line; keep-alives start with ":"
+      let boundary
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const message = buffer.slice(0, boundary)
+        buffer = buffer.slice(boundary + 2)
+
+        let type = "message"
+        let data = ""
+        for (const line of message.split("\n")) {
+          if (line.startsWith("event: ")) type = line.slice(7)
+          else if (line.startsWith("data: ")) data += line.slice(6)
+        }
+        if (!data) continue
+
+        const parsed = JSON.parse(data)
+        if (type === "status") status = parsed
+        onEvent(type, parsed)
+      }
+    }
+
+    return status
+  }
+
+  async generateImageBatch(prompts: string[], numImages = 1) {
+    return this.post("/api/images/generate/batch", { prompts, numImages })
+  }
 }
 
 // Create and export a singleton instance
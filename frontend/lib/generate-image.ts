@@ -1,15 +1,63 @@
 import apiClient from "./api-client"
 
-export async function generateImage(prompt: string): Promise<{ imageUrl: string; imageId?: string }> {
+const POLL_INTERVAL = 1000 // 1 second
+const POLL_TIMEOUT = 120000 // 2 minutes
+// Follow jobs over their event stream (queue position and logs) instead of
+// polling; only for backends running async workers with EVENT_STREAMS=true
+const STREAM_EVENTS = process.env.NEXT_PUBLIC_GENERATION_EVENTS === "true"
+
+export type GenerationProgress = { type: "queue"; position: number } | { type: "log"; message: string }
+
+// Poll a job until it leaves the queued/running states
+async function pollGenerationJob(jobId: string, submitted: any) {
+  const deadline = Date.now() + POLL_TIMEOUT
+  let response = submitted
+  while (response.status !== "done" && response.status !== "failed") {
+    if (Date.now() > deadline) {
+      throw new Error("Image generation timed out. Please try again.")
+    }
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL))
+    response = await apiClient.getGenerationJob(jobId)
+    if (!response.success) {
+      throw new Error(response.message || "Failed to generate image")
+    }
+  }
+  return response
+}
+
+export async function generateImage(
+  prompt: string,
+  onProgress?: (progress: GenerationProgress) => void,
+): Promise<{ imageUrl: string; imageId?: string }> {
   try {
     console.log("Generating image with prompt:", prompt)
 
-    // With the async approach, we just make a single request and wait for the result
-    const response = await apiClient.generateImage(prompt)
-    console.log("Generate image response:", response)
+    // Queue the generation job, then follow it until it finishes
+    const submitted = await apiClient.generateImage(prompt)
+    console.log("Generate image response:", submitted)
 
-    if (!response.success) {
-      console.error("Failed to generate image:", response.message)
+    if (!submitted.success || !submitted.jobId) {
+      console.error("Failed to generate image:", submitted.message)
+      throw new Error(submitted.message || "Failed to generate image")
+    }
+
+    // Poll the job, or follow its event stream and fall back to polling if it drops
+    let response = submitted
+    if (STREAM_EVENTS && response.status !== "done") {
+      try {
+        response = await apiClient.streamGenerationJob(submitted.jobId, (type, data) => {
+          if (type !== "status") onProgress?.(data)
+        })
+      } catch (error) {
+        console.warn("Generation event stream failed, polling instead:", error)
+        response = null
+      }
+    }
+    if (!response || (response.status !== "done" && response.status !== "failed")) {
+      response = await pollGenerationJob(submitted.jobId, response || submitted)
+    }
+
+    if (response.status === "failed") {
       throw new Error(response.message || "Failed to generate image")
     }
 
@@ -6,6 +6,8 @@ import { createContext, useContext, useState, useEffect } from "react"
 export type ImageItem = {
   id: string
   imageUrl: string
+  // Resized WebP/AVIF copies, once the backend has made them
+  srcset?: string
   prompt: string
   createdAt: string
 }
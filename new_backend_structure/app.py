@@ -1,55 +1,131 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
+import logging
 import os
 from models import db, User, Image, UserImage
 from routes.auth import auth_bp
 from routes.user import user_bp
-from routes.images import images_bp
+from routes.images import images_bp, process_generation_job, save_image_asset, GENERATION_TIMEOUT
+from routes.webhooks import webhooks_bp, expire_stale_requests
+from utils.jobs import job_queue
+from utils.assets import asset_store
+from utils.catalog import predefined_catalog
+from utils.hashing import HashingBusy, password_hasher
+from utils.avatars import AvatarBusy
+from utils.migrations import pending_migrations
+from utils.metrics import metrics
+from utils.log import json_logging
+from utils.serialize import FastJSONProvider
+from utils.compression import compression
+from utils.pool import engine_options, pool_monitor
+from utils.replica import replica_router, STICKY_HEADER
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
+# Fork the password hashing workers before anything below starts a thread
+password_hasher.start()
+
 # Initialize Flask app
 app = Flask(__name__)
-# Enable CORS for all routes with proper configuration
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+
+# JSON logs written off the request path, tagged with a per-request id
+json_logging.init_app(app)
+# Serialise responses with orjson when it is installed
+app.json = FastJSONProvider(app)
+# Enable CORS for all routes with proper configuration; the frontend reads
+# the replica read-your-writes deadline from responses
+CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True, expose_headers=[STICKY_HEADER])
 
 # Neon PostgreSQL Database Configuration
 database_url = os.getenv('DATABASE_URL')
 
 # Configure PostgreSQL database
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+# Pool sizing, recycling, pre-ping and statement timeouts (see utils/pool.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(database_url)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('JWT_SECRET', 'default-secret-key')
 
+# Let Apache/lighttpd send stored images themselves (X-Sendfile)
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+
+# Number of background workers draining the image generation queue
+app.config['GENERATION_WORKERS'] = int(os.getenv('GENERATION_WORKERS', 4))
+
+# Route read-only requests to REPLICA_DATABASE_URL, if set
+replica_router.init_app(app)
+
 # Initialize database
 db.init_app(app)
+pool_monitor.init_app(app, db)
+
+# Per-request timing, SQL counts, Server-Timing headers and /metrics
+metrics.init_app(app)
+# Brotli/gzip for larger JSON responses
+compression.init_app(app)
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(user_bp, url_prefix='/api/user')
 app.register_blueprint(images_bp, url_prefix='/api/images')
+app.register_blueprint(webhooks_bp, url_prefix='/api/webhooks')
+
+def start_services(app):
+    """Seed the admin user and start the catalog, asset store and generation workers.
+
+    They query every column models.py declares, so they only start once
+    the schema is current.
+    """
+    with app.app_context():
+        # Create admin user if it doesn't exist
+        admin_email = os.getenv('ADMIN_EMAIL', 'admin@example.com')
+        admin_password = os.getenv('ADMIN_PASSWORD', 'admin123')
+
+        admin = User.query.filter_by(email=admin_email).first()
+        if not admin:
+            admin = User(
+                name='Admin',
+                email=admin_email,
+                password=admin_password,
+                role='admin'
+            )
+            db.session.add(admin)
+            db.session.commit()
+            logger.info('Admin user created')
+
+    # Seed and cache the predefined image catalog
+    predefined_catalog.init_app(app)
+
+    # Copy generated images into the asset store and make their thumbnails
+    asset_store.init_app(app, db, handler=save_image_asset)
+
+    # Start the generation workers once the tables exist; jobs running for
+    # well past the generation timeout were left behind by a dead process
+    job_queue.init_app(
+        app,
+        handler=process_generation_job,
+        stale_after=GENERATION_TIMEOUT + 60,
+        # fal.ai webhooks that never arrive fail their jobs after the same time
+        sweep=expire_stale_requests
+    )
 
 # Create database tables
 with app.app_context():
     db.create_all()
-    
-    # Create admin user if it doesn't exist
-    admin_email = os.getenv('ADMIN_EMAIL', 'admin@example.com')
-    admin_password = os.getenv('ADMIN_PASSWORD', 'admin123')
-
-    admin = User.query.filter_by(email=admin_email).first()
-    if not admin:
-        admin = User(
-            name='Admin',
-            email=admin_email,
-            password=admin_password,
-            role='admin'
-        )
-        db.session.add(admin)
-        db.session.commit()
-        print('Admin user created successfully')
+    # Schema changes to existing tables are applied by init_db.py --migrate
+    missing = pending_migrations()
+
+if missing:
+    # Importing the app (as init_db.py does) must still work, so the
+    # migration can run
+    logger.error('Database schema is behind models.py (missing %s); run python init_db.py --migrate '
+                 'and restart. Background services are not started.', ', '.join(missing))
+else:
+    start_services(app)
 
 # Root route
 @app.route('/')
@@ -68,6 +144,18 @@ def not_found(error):
         'error': str(error)
     }), 404
 
+@app.errorhandler(HashingBusy)
+@app.errorhandler(AvatarBusy)
+def worker_pool_busy(error):
+    # Password hashing or avatar pool is saturated; ask the client to back off
+    response = jsonify({
+        'success': False,
+        'message': 'Server is busy, please try again shortly',
+        'error': str(error)
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 429
+
 @app.errorhandler(500)
 def server_error(error):
     return jsonify({
@@ -0,0 +1,303 @@
+"""Latency and throughput of the API's hot endpoints against a seeded database.
+
+Usage: python benchmarks/api.py [--database-url URL] [--users 20] [--images 500]
+                                [--requests 200] [--threads 8] [--output report.json]
+
+Runs the app in-process through Flask's test client, against a fresh SQLite
+file or ``--database-url`` (e.g. a local Postgres). It seeds ``--users``
+users with ``--images`` images each, with the local provider standing in
+for fal.ai. Then each scenario runs ``--requests`` calls over ``--threads``
+threads. The JSON report has one entry per scenario and can be diffed
+between releases.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import local
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(q / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(ms, 50), 2) if ms else None,
+        'p90_ms': round(percentile(ms, 90), 2) if ms else None,
+        'p99_ms': round(percentile(ms, 99), 2) if ms else None,
+        'max_ms': round(ms[-1], 2) if ms else None
+    }
+
+
+def seed(app, users, images, rng):
+    """Insert ``users`` users with ``images`` images each in bulk; returns their details"""
+    from sqlalchemy import insert
+    from models import db, User, Image, UserImage
+    from utils.auth import generate_token
+    from utils.hashing import password_hasher
+
+    run = uuid.uuid4().hex[:8]
+    seeded = []
+    with app.app_context():
+        hashed = password_hasher.hash('benchmark-password')
+        now = datetime.utcnow()
+
+        for u in range(users):
+            user_id = str(uuid.uuid4())
+            email = f'bench-{run}-{u}@example.com'
+            image_rows, user_image_rows = [], []
+            for i in range(images):
+                image_id = str(uuid.uuid4())
+                created_at = now - timedelta(seconds=images - i)
+                image_rows.append({
+                    'id': image_id,
+                    'image_url': f'https://bench.example/{run}/{u}/{i}.png',
+                    'prompt': f'benchmark image {i}',
+                    'created_at': created_at
+                })
+                user_image_rows.append({
+                    'id': str(uuid.uuid4()),
+                    'user_id': user_id,
+                    'image_id': image_id,
+                    'is_loved': rng.random() < 0.3,
+                    'is_saved': rng.random() < 0.2,
+                    'created_at': created_at
+                })
+
+            db.session.execute(insert(User), [{'id': user_id, 'name': f'Bench {u}', 'email': email, 'password': hashed}])
+            if image_rows:
+                db.session.execute(insert(Image), image_rows)
+                db.session.execute(insert(UserImage), user_image_rows)
+            db.session.commit()
+
+            seeded.append({
+                'id': user_id,
+                'email': email,
+                'headers': {'Authorization': f'Bearer {generate_token(user_id)}'},
+                'image_ids': [row['id'] for row in image_rows]
+            })
+    return run, seeded
+
+
+def scenarios(run, users, slugs):
+    """Benchmark name -> function(client, i) returning whether call ``i`` succeeded"""
+
+    def user(i):
+        return users[i % len(users)]
+
+    def image_id(i):
+        # Spread calls over each user's images, the same way every run
+        images = user(i)['image_ids']
+        return images[(i * 7919) % len(images)] if images else str(uuid.uuid4())
+
+    def ok(response):
+        return response.status_code < 400
+
+    def signup(client, i):
+        return ok(client.post('/api/auth/signup', json={
+            'name': 'Bench', 'email': f'bench-{run}-signup-{i}@example.com', 'password': 'benchmark-password'
+        }))
+
+    def login(client, i):
+        return ok(client.post('/api/auth/login', json={'email': user(i)['email'], 'password': 'benchmark-password'}))
+
+    def get_images(client, i):
+        return ok(client.get('/api/images/', headers=user(i)['headers']))
+
+    def get_images_loved(client, i):
+        return ok(client.get('/api/images/?filter=loved', headers=user(i)['headers']))
+
+    def predefined_status(client, i):
+        return ok(client.get(f'/api/images/predefined/status?slug={slugs[i % len(slugs)]}', headers=user(i)['headers']))
+
+    def predefined_statuses(client, i):
+        return ok(client.post('/api/images/predefined/status', json={'slugs': slugs}, headers=user(i)['headers']))
+
+    def predefined_save(client, i):
+        return ok(client.post('/api/images/predefined/save', json={
+            'slug': slugs[i % len(slugs)], 'isLoved': i % 2 == 0, 'isSaved': i % 3 == 0
+        }, headers=user(i)['headers']))
+
+    def toggle_love(client, i):
+        return ok(client.put(f'/api/images/{image_id(i)}/love', json={'isLoved': i % 2 == 0}, headers=user(i)['headers']))
+
+    def toggle_save(client, i):
+        return ok(client.put(f'/api/images/{image_id(i)}/save', json={'isSaved': i % 2 == 0}, headers=user(i)['headers']))
+
+    def generate(client, i):
+        # End to end: queue the job, then poll it until a worker finishes it
+        headers = user(i)['headers']
+        response = client.post('/api/images/generate', json={'prompt': f'benchmark {run} {i}'}, headers=headers)
+        if not ok(response):
+            return False
+        job_id = response.get_json()['jobId']
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            status = client.get(f'/api/images/generate/{job_id}', headers=headers).get_json()['status']
+            if status in ('done', 'failed'):
+                return status == 'done'
+            time.sleep(0.005)
+        return False
+
+    return {
+        'signup': signup,
+        'login': login,
+        'get_images': get_images,
+        'get_images_loved': get_images_loved,
+        'predefined_status': predefined_status,
+        'predefined_statuses': predefined_statuses,
+        'predefined_save': predefined_save,
+        'toggle_love': toggle_love,
+        'toggle_save': toggle_save,
+        'generate': generate
+    }
+
+
+def run_scenario(app, func, requests, threads, warmup):
+    clients = local()
+
+    def call(i):
+        if not hasattr(clients, 'client'):
+            clients.client = app.test_client()
+        start = time.perf_counter()
+        try:
+            succeeded = func(clients.client, i)
+        except Exception as e:
+            print(f'Benchmark call failed: {str(e)}', file=sys.stderr)
+            succeeded = False
+        return succeeded, time.perf_counter() - start
+
+    for i in range(warmup):
+        call(i)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(call, range(warmup, warmup + requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for succeeded, latency in results if succeeded]
+    return summarize(latencies, len(results) - len(latencies), elapsed)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--images', type=int, default=500, help='images per user')
+    parser.add_argument('--requests', type=int, default=200, help='calls per scenario')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=5, help='untimed calls per scenario')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--provider-latency-ms', type=float, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', action='append', help='only run these scenarios')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    tmpdir = None
+    database_url = args.database_url
+    if not database_url:
+        tmpdir = tempfile.mkdtemp(prefix='bench-')
+        database_url = f'sqlite:///{os.path.join(tmpdir, "bench.db")}'
+
+    # Configuration is read at import time, so set it before importing the app
+    os.environ.update({
+        'DATABASE_URL': database_url,
+        'IMAGE_PROVIDER': 'local',
+        'LOCAL_LATENCY_MS': str(args.provider_latency_ms),
+        'LOCAL_LATENCY_DISTRIBUTION': 'fixed',
+        'LOCAL_FAILURE_RATE': '0',
+        'LOCAL_RANDOM_SEED': str(args.seed),
+        'BCRYPT_ROUNDS': str(args.bcrypt_rounds)
+    })
+    os.environ.pop('FAL_WEBHOOK_URL', None)
+
+    # The app logs to stdout; keep it for the report
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    from app import app
+    from models import db
+    from utils.catalog import predefined_catalog
+    from utils.assets import asset_store
+    from utils.jobs import job_queue
+
+    try:
+        rng = random.Random(args.seed)
+        seed_start = time.perf_counter()
+        run, users = seed(app, args.users, args.images, rng)
+        seed_seconds = time.perf_counter() - seed_start
+
+        slugs = [entry['slug'] for entry in predefined_catalog.entries]
+        selected = scenarios(run, users, slugs)
+        if args.scenario:
+            selected = {name: selected[name] for name in args.scenario}
+
+        results = {}
+        for name, func in selected.items():
+            print(f'Running {name}...', file=sys.stderr)
+            results[name] = run_scenario(app, func, args.requests, args.threads, args.warmup)
+
+        with app.app_context():
+            dialect = db.engine.dialect.name
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'timestamp': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'database': dialect,
+                'users': args.users,
+                'images_per_user': args.images,
+                'requests': args.requests,
+                'threads': args.threads,
+                'bcrypt_rounds': args.bcrypt_rounds,
+                'provider_latency_ms': args.provider_latency_ms,
+                'seed': args.seed,
+                'seed_seconds': round(seed_seconds, 3)
+            },
+            'scenarios': results
+        }
+        print(json.dumps(report, indent=2), file=stdout)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+    finally:
+        sys.stdout = stdout
+        # Let the generation and asset workers finish before their database goes
+        job_queue.shutdown()
+        asset_store.shutdown()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Password verification throughput against the number of hashing workers.
+
+Usage: python benchmarks/hashing.py [--requests 200] [--threads 32] [--rounds 12]
+
+Simulates a burst of logins: ``--threads`` request threads verify passwords
+through a PasswordHasher sized from 1 worker up to the core count.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.hashing import PasswordHasher, HashingBusy, _hash
+
+
+def run(workers, requests, threads, rounds):
+    hasher = PasswordHasher(workers=workers, max_pending=threads, rounds=rounds)
+    hashed = _hash('benchmark-password', rounds)
+    hasher.start()  # before the request threads, and outside the timing
+
+    rejected = 0
+
+    def login(_):
+        nonlocal rejected
+        try:
+            return hasher.verify('benchmark-password', hashed)
+        except HashingBusy:
+            rejected += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(login, range(requests)))
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+
+    return {
+        'workers': workers,
+        'requests': requests,
+        'rejected': rejected,
+        'seconds': round(elapsed, 3),
+        'logins_per_second': round((requests - rejected) / elapsed, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=12)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, *range(2, cores + 1, 2), cores})
+    results = [run(workers, args.requests, args.threads, args.rounds) for workers in worker_counts]
+    print(json.dumps({'cores': cores, 'rounds': args.rounds, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Connection pool behaviour under a burst of requests at startup.
+
+Usage: python benchmarks/pool.py [--database-url URL] [--threads 100] [--rounds 5]
+
+Imports the app (with the pool configured from the DB_* environment
+variables), then releases ``--threads`` threads at once, each making
+``--rounds`` authenticated gallery requests. The report shows how many
+connections the pool opened and the peak number checked out. If the pool
+is holding the line, both stay at or under pool_size + max_overflow no
+matter how many threads there are.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api import summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file')
+    parser.add_argument('--threads', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = None
+    database_url = args.database_url
+    if not database_url:
+        tmpdir = tempfile.mkdtemp(prefix='bench-')
+        database_url = f'sqlite:///{os.path.join(tmpdir, "bench.db")}'
+    os.environ['DATABASE_URL'] = database_url
+
+    # The app logs to stdout; keep it for the report
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    from sqlalchemy import event
+    from app import app
+    from models import db
+    from utils.auth import generate_token
+    from utils.pool import pool_monitor
+    from utils.assets import asset_store
+    from utils.jobs import job_queue
+
+    try:
+        with app.app_context():
+            engine = db.engine
+            user_id = db.session.execute(db.text('SELECT id FROM users LIMIT 1')).scalar()
+        headers = {'Authorization': f'Bearer {generate_token(user_id)}'}
+
+        # Startup itself (tables, migrations, catalog, job requeue) used these
+        opened_at_startup = pool_monitor.connections_opened.value()
+
+        lock = threading.Lock()
+        usage = {'current': 0, 'peak': 0}
+
+        @event.listens_for(engine.pool, 'checkout')
+        def checkout(*args):
+            with lock:
+                usage['current'] += 1
+                usage['peak'] = max(usage['peak'], usage['current'])
+
+        @event.listens_for(engine.pool, 'checkin')
+        def checkin(*args):
+            with lock:
+                usage['current'] -= 1
+
+        barrier = threading.Barrier(args.threads)
+        latencies, errors = [], []
+
+        def worker():
+            client = app.test_client()
+            barrier.wait()
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                response = client.get('/api/images/', headers=headers)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    (latencies if response.status_code == 200 else errors).append(elapsed)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        pool = engine.pool
+        opened = pool_monitor.connections_opened.value()
+        report = {
+            'database': engine.dialect.name,
+            'pool': type(pool).__name__,
+            'pool_size': pool.size() if hasattr(pool, 'size') else None,
+            'max_overflow': getattr(pool, '_max_overflow', None),
+            'threads': args.threads,
+            'connections_opened_at_startup': opened_at_startup,
+            'connections_opened_under_load': opened - opened_at_startup,
+            'peak_checked_out': usage['peak'],
+            'requests': summarize(latencies, len(errors), elapsed)
+        }
+        print(json.dumps(report, indent=2), file=stdout)
+    finally:
+        sys.stdout = stdout
+        # Let the generation and asset workers finish before their database goes
+        job_queue.shutdown()
+        asset_store.shutdown()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
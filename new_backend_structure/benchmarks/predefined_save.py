@@ -0,0 +1,109 @@
+"""Concurrent saves of the same predefined image by one user.
+
+Usage: python benchmarks/predefined_save.py [--database-url URL] [--threads 20]
+
+Imports the app, then releases ``--threads`` threads at once, each saving
+the same non-catalog image URL for the same user. However the saves
+interleave, they must leave exactly one ``images`` row for the URL and one
+``user_images`` row linking it to the user. The report shows the counts
+and the exit status is non-zero if either is off.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api import summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='defaults to a fresh SQLite file')
+    parser.add_argument('--threads', type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = None
+    database_url = args.database_url
+    if not database_url:
+        tmpdir = tempfile.mkdtemp(prefix='bench-')
+        database_url = f'sqlite:///{os.path.join(tmpdir, "bench.db")}'
+    os.environ['DATABASE_URL'] = database_url
+
+    # The app logs to stdout; keep it for the report
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    from app import app
+    from models import db, Image, UserImage
+    from utils.auth import generate_token
+    from utils.assets import asset_store
+    from utils.jobs import job_queue
+
+    try:
+        with app.app_context():
+            user_id = db.session.execute(db.text('SELECT id FROM users LIMIT 1')).scalar()
+        headers = {'Authorization': f'Bearer {generate_token(user_id)}'}
+        # A fresh URL each run, so the check also holds against a reused database
+        image_url = f'https://example.com/bench/{uuid.uuid4()}.png'
+
+        lock = threading.Lock()
+        barrier = threading.Barrier(args.threads)
+        latencies, errors = [], []
+
+        def worker():
+            client = app.test_client()
+            barrier.wait()
+            start = time.perf_counter()
+            response = client.post('/api/images/predefined/save', headers=headers, json={
+                'imageUrl': image_url, 'prompt': 'benchmark', 'isSaved': True
+            })
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if response.status_code == 200 else errors).append(elapsed)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            dialect = db.engine.dialect.name
+            image_ids = [row.id for row in Image.query.filter_by(image_url=image_url)]
+            user_images = UserImage.query.filter(
+                UserImage.user_id == user_id,
+                UserImage.image_id.in_(image_ids)
+            ).count()
+
+        report = {
+            'database': dialect,
+            'threads': args.threads,
+            'images': len(image_ids),
+            'user_images': user_images,
+            'requests': summarize(latencies, len(errors), elapsed)
+        }
+        print(json.dumps(report, indent=2), file=stdout)
+    finally:
+        sys.stdout = stdout
+        # Let the generation and asset workers finish before their database goes
+        job_queue.shutdown()
+        asset_store.shutdown()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if len(image_ids) != 1 or user_images != 1 or errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Serialisation time and response size of a large gallery page.
+
+Usage: python benchmarks/serialize.py [--images 5000] [--repeat 20] [--output report.json]
+
+Builds a ``get_images`` response of ``--images`` rows in memory (no
+database) and serialises it ``--repeat`` times with Flask's default JSON
+provider, whose rows need ``isoformat()`` per timestamp, and with the
+app's FastJSONProvider, which serialises the datetimes itself (through
+orjson if it is installed). The body is then compressed with each
+encoding the app supports. The report gives median timings in
+milliseconds and sizes in bytes.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api import git_revision
+
+
+def rows(count):
+    """Gallery rows shaped like get_images builds them, with thumbnails"""
+    from utils.assets import asset_store
+
+    now = datetime.utcnow()
+    result = []
+    for i in range(count):
+        key = uuid.uuid4().hex * 2
+        asset = {'key': key, 'format': 'png', 'widths': [256, 512, 1024], 'formats': ['webp', 'avif']}
+        created_at = now - timedelta(minutes=i)
+        result.append({
+            'id': str(uuid.uuid4()),
+            'image_url': f'https://fal.media/files/{uuid.uuid4().hex}.png',
+            'prompt': f'image {i} cartoon style, vibrant colors, clean lines, flat shading, exaggerated features, playful, 2D illustration',
+            **asset_store.sources(asset),
+            'created_at': created_at,
+            'updated_at': created_at,
+            'is_loved': i % 3 == 0,
+            'is_saved': i % 5 == 0
+        })
+    return result
+
+
+def timed(func, repeat):
+    """Median milliseconds of ``repeat`` calls, and the last result"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 2), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    from utils import serialize
+    from utils.compression import compression
+
+    app = Flask(__name__)
+    default = DefaultJSONProvider(app)
+    fast = serialize.FastJSONProvider(app)
+    images = rows(args.images)
+
+    def with_default():
+        # What every route did before: isoformat() per timestamp, then the stdlib encoder
+        payload = [{
+            **image,
+            'created_at': image['created_at'].isoformat(),
+            'updated_at': image['updated_at'].isoformat()
+        } for image in images]
+        return default.response({'success': True, 'images': payload, 'next_cursor': None}).get_data()
+
+    def with_fast():
+        return fast.response({'success': True, 'images': images, 'next_cursor': None}).get_data()
+
+    with app.test_request_context():
+        default_ms, default_body = timed(with_default, args.repeat)
+        fast_ms, body = timed(with_fast, args.repeat)
+
+    sizes = {'identity': len(body)}
+    compress_ms = {}
+    for encoding in compression.encodings:
+        compress_ms[encoding], compressed = timed(lambda: compression.compress(body, encoding), args.repeat)
+        sizes[encoding] = len(compressed)
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'images': args.images,
+            'repeat': args.repeat,
+            'orjson': serialize.orjson is not None
+        },
+        'serialize_ms': {'flask_default': default_ms, 'fast_provider': fast_ms},
+        'identical_output': json.loads(default_body) == json.loads(body),
+        'compress_ms': compress_ms,
+        'bytes': sizes
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
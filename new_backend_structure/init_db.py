@@ -1,12 +1,72 @@
+import sys
+from datetime import datetime
+from sqlalchemy import text
 from app import app, db
-from models import User
+from routes.images import gallery_query, user_image_query, image_status_query, cached_image_query
+from utils.migrations import migrate_schema
 
 def init_db():
     with app.app_context():
         # Create all tables
         db.create_all()
-        
+
         print('Database initialized successfully')
 
+def migrate_db():
+    """Add the columns and indexes an existing database is missing"""
+    with app.app_context():
+        migrate_schema()
+
+        print('Database migrated successfully')
+
+def route_queries():
+    """The hot route queries, built by the routes' own helpers with placeholder values"""
+    user_id = '00000000-0000-0000-0000-000000000000'
+    cursor = (datetime(2024, 1, 1), user_id)
+
+    queries = {
+        'get_images': gallery_query(user_id),
+        'get_images (next page)': gallery_query(user_id, cursor=cursor),
+        'get_images?filter=loved': gallery_query(user_id, 'loved'),
+        'get_images?filter=saved': gallery_query(user_id, 'saved'),
+        'get_image / toggles': user_image_query(user_id, user_id),
+        'predefined status': image_status_query(user_id, ['/categories/get_dressed.jpg']),
+        'generation cache': cached_image_query('0' * 64),
+    }
+    return {name: query.statement for name, query in queries.items()}
+
+def check_indexes():
+    """EXPLAIN each hot route query and report any that fall back to a table scan"""
+    failures = []
+    with app.app_context():
+        dialect = db.engine.dialect
+        with db.engine.connect() as conn:
+            if dialect.name == 'postgresql':
+                # Small tables are cheaper to scan; ask for the plan the index would give
+                conn.execute(text('SET enable_seqscan = off'))
+
+            for name, query in route_queries().items():
+                sql = str(query.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+                if dialect.name == 'sqlite':
+                    plan = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+                    scans = [step for step in plan if step.startswith('SCAN') and 'INDEX' not in step]
+                else:
+                    plan = [row[0] for row in conn.execute(text(f'EXPLAIN {sql}'))]
+                    scans = [step for step in plan if 'Seq Scan' in step]
+
+                print(f"{'FAIL' if scans else 'ok'}  {name}")
+                for step in plan:
+                    print(f'      {step}')
+                if scans:
+                    failures.append(name)
+
+    return failures
+
 if __name__ == '__main__':
-    init_db()
\ No newline at end of file
+    if '--migrate' in sys.argv:
+        init_db()
+        migrate_db()
+    elif '--check-indexes' in sys.argv:
+        sys.exit(1 if check_indexes() else 0)
+    else:
+        init_db()
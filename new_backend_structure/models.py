@@ -1,9 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import uuid
-import bcrypt
+from utils.assets import asset_store
+from utils.hashing import password_hasher
+from utils.replica import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -14,11 +16,15 @@ class User(db.Model):
     password = db.Column(db.String(100), nullable=False)
     avatar_url = db.Column(db.Text, default='/placeholder.svg')
     role = db.Column(db.String(20), default='user')
+    # Bumped with every change to the user's images or profile (see utils/collection.py)
+    collection_version = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
     updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     user_images = db.relationship('UserImage', backref='user', lazy=True, cascade='all, delete-orphan')
+    generation_jobs = db.relationship('GenerationJob', backref='user', lazy=True, cascade='all, delete-orphan')
+    image_requests = db.relationship('ImageRequest', backref='user', lazy=True, cascade='all, delete-orphan')
 
     def __init__(self, name, email, password, role='user', avatar_url='/placeholder.svg'):
         self.id = str(uuid.uuid4())
@@ -29,10 +35,13 @@ class User(db.Model):
         self.avatar_url = avatar_url
 
     def set_password(self, password):
-        self.password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password = password_hasher.hash(password)
 
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password.encode('utf-8'))
+        return password_hasher.verify(password, self.password)
+
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password)
 
     def to_dict(self, exclude_password=True):
         data = {
@@ -54,22 +63,35 @@ class Image(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     image_url = db.Column(db.Text, nullable=False)
     prompt = db.Column(db.Text, nullable=False)
+    # Hash of the generation inputs, for reusing results of identical prompts
+    cache_key = db.Column(db.String(64), nullable=True)
+    # Stored copy and derivatives (see utils/assets.py); null until ingested
+    asset = db.Column(db.JSON, nullable=True)
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
     updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     user_images = db.relationship('UserImage', backref='image', lazy=True, cascade='all, delete-orphan')
 
-    def __init__(self, image_url, prompt):
+    __table_args__ = (
+        # Predefined images are looked up by URL
+        db.Index('uix_images_image_url', 'image_url', unique=True),
+        # Generation cache lookups
+        db.Index('ix_images_cache_key', 'cache_key'),
+    )
+
+    def __init__(self, image_url, prompt, cache_key=None):
         self.id = str(uuid.uuid4())
         self.image_url = image_url
         self.prompt = prompt
+        self.cache_key = cache_key
 
     def to_dict(self):
         return {
             'id': self.id,
             'image_url': self.image_url,
             'prompt': self.prompt,
+            **asset_store.sources(self.asset),
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
@@ -86,7 +108,23 @@ class UserImage(db.Model):
     updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
     __table_args__ = (
+        # Also serves every (user_id, image_id) lookup
         db.UniqueConstraint('user_id', 'image_id', name='uix_user_image'),
+        # Gallery pages, newest first, keyed on (user_id, created_at, id)
+        db.Index('ix_user_images_user_created', 'user_id', 'created_at', 'id'),
+        # Loved / saved gallery filters only index the matching rows
+        db.Index(
+            'ix_user_images_user_loved', 'user_id', 'created_at', 'id',
+            postgresql_where=is_loved.is_(True),
+            sqlite_where=is_loved.is_(True)
+        ),
+        db.Index(
+            'ix_user_images_user_saved', 'user_id', 'created_at', 'id',
+            postgresql_where=is_saved.is_(True),
+            sqlite_where=is_saved.is_(True)
+        ),
+        # Cascading deletes from images
+        db.Index('ix_user_images_image_id', 'image_id'),
     )
 
     def __init__(self, user_id, image_id, is_loved=False, is_saved=False):
@@ -105,4 +143,77 @@ class UserImage(db.Model):
             'is_saved': self.is_saved,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class GenerationJob(db.Model):
+    __tablename__ = 'generation_jobs'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    # queued -> running -> done | failed
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    image_id = db.Column(db.String(36), db.ForeignKey('images.id', ondelete='SET NULL'), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    seed = db.Column(db.Integer, nullable=True)
+    # Opted into reusing an existing image generated from the same inputs
+    use_cache = db.Column(db.Boolean, default=False)
+    cache_key = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, user_id, prompt, seed=None, use_cache=False, cache_key=None):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.prompt = prompt
+        self.seed = seed
+        self.use_cache = use_cache
+        self.cache_key = cache_key
+        self.status = 'queued'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'prompt': self.prompt,
+            'image_id': self.image_id,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class ImageRequest(db.Model):
+    __tablename__ = 'image_requests'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    # fal.ai queue request id, echoed back in the webhook payload
+    request_id = db.Column(db.String(100), unique=True, nullable=False)
+    job_id = db.Column(db.String(36), db.ForeignKey('generation_jobs.id', ondelete='SET NULL'), nullable=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    # pending -> processing -> completed | failed
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    image_id = db.Column(db.String(36), db.ForeignKey('images.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, request_id, user_id, prompt, job_id=None):
+        self.id = str(uuid.uuid4())
+        self.request_id = request_id
+        self.user_id = user_id
+        self.prompt = prompt
+        self.job_id = job_id
+        self.status = 'pending'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'request_id': self.request_id,
+            'job_id': self.job_id,
+            'user_id': self.user_id,
+            'prompt': self.prompt,
+            'status': self.status,
+            'image_id': self.image_id,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify
 from models import db, User
-from utils.auth import generate_token
+from utils.auth import generate_token, invalidate_user
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
+import logging
 import os
 import uuid
 import secrets
@@ -12,6 +13,7 @@ from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 
 auth_bp = Blueprint('auth', __name__)
+logger = logging.getLogger(__name__)
 
 # Store reset tokens in memory (in a real app, you'd use a database)
 password_reset_tokens = {}
@@ -83,6 +85,12 @@ def login():
             'message': 'Invalid Password'
         }), 401
     
+    # Upgrade hashes made with a different bcrypt cost while we have the password
+    if user.password_needs_rehash():
+        user.set_password(password)
+        db.session.commit()
+        invalidate_user(user.id)
+    
     # Generate token
     token = generate_token(user.id)
     
@@ -145,7 +153,7 @@ def google_auth():
         })
     
     except Exception as e:
-        print(f"Google auth error: {str(e)}")
+        logger.warning("Google auth error: %s", e)
         return jsonify({
             'success': False,
             'message': 'Failed to authenticate with Google'
@@ -186,21 +194,21 @@ def reset_password():
     # For this example, we'll just log it
     host_url = 'http://localhost:3000/'
     reset_link = f"{host_url}reset-password-confirm?token={token}"
-    print(f"Password reset link for {email}: {reset_link}")
+    logger.debug("Password reset link for %s: %s", email, reset_link)
     
     # Simulate sending an email
     try:
         # This is a placeholder - in a real app, you'd configure your SMTP server
         # send_reset_email(email, reset_link)
-        print(f"Would send email to {email} with reset link: {reset_link}")
+        logger.info("Sending password reset email", extra={'email': email})
         send_reset_email(email, reset_link)
         
         return jsonify({
             'success': True,
             'message': 'Password reset instructions sent to your email'
         })
-    except Exception as e:
-        print(f"Error sending reset email: {str(e)}")
+    except Exception:
+        logger.exception("Error sending reset email")
         return jsonify({
             'success': False,
             'message': 'Failed to send reset email'
@@ -247,6 +255,7 @@ def reset_password_confirm():
     # Update password
     user.set_password(new_password)
     db.session.commit()
+    invalidate_user(user.id)
     
     # Remove used token
     password_reset_tokens.pop(token, None)
@@ -1,54 +1,198 @@
-from flask import Blueprint, request, jsonify
-from models import db, User, Image, UserImage
-from utils.auth import token_required
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from models import db, User, Image, UserImage, GenerationJob, ImageRequest
+from utils.auth import token_required, claims_required
+from utils.replica import read_only, stick_to_primary
+from utils.jobs import job_queue
+from utils.events import job_events
+from utils.catalog import predefined_catalog
+from utils.upsert import upsert
+from utils.assets import asset_store
+from utils.collection import bump_collection_version, cache_validated, collection_etag, collection_version, not_modified
+from utils.fal import generation_cache_key, fal_loop
+from utils.providers import get_provider, render_png
+from utils.metrics import metrics
+from utils.log import log_sampled
+import logging
 import os
+import re
 import time
 import uuid
-import fal_client
-import json
 import asyncio
+import weakref
+from concurrent.futures import TimeoutError
+import json
+import base64
+import binascii
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import tuple_
 
 images_bp = Blueprint('images', __name__)
+logger = logging.getLogger(__name__)
+
+# Seconds a worker waits for fal.ai before failing the job
+GENERATION_TIMEOUT = 120
+
+# Gallery page sizes
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Most predefined image URLs accepted by one batch status request
+MAX_STATUS_BATCH = 200
+
+# Batch generation limits; each user's batches share BATCH_USER_CONCURRENCY slots
+MAX_BATCH_PROMPTS = 10
+MAX_IMAGES_PER_PROMPT = 4
+BATCH_USER_CONCURRENCY = int(os.getenv('BATCH_USER_CONCURRENCY', 3))
+
+# Appended to every generation prompt
+STYLE_SUFFIX = 'cartoon style, vibrant colors, clean lines, flat shading, exaggerated features, playful, 2D illustration'
+
+# Per-user batch semaphores, dropped once no batch holds them
+_batch_limits = weakref.WeakValueDictionary()
+
+# Files served from the asset store: image originals and thumbnails, then avatars
+ASSET_NAME = re.compile(
+    r'[0-9a-f]{2}/[0-9a-f]{64}/(original|\d+w)\.(png|jpeg|webp|avif)'
+    r'|avatars/[0-9a-f-]{36}/[0-9a-f]{16}(-\d+)?\.(png|jpeg|webp)'
+)
+
+# Job event streams hold a server thread (or greenlet) for up to
+# EVENT_STREAM_TIMEOUT, so they are off unless the server runs async workers
+# (e.g. gunicorn -k gevent); clients poll /generate/<job_id> instead
+EVENT_STREAMS = os.getenv('EVENT_STREAMS', 'false').lower() == 'true'
+# Seconds between keep-alives on a job's event stream, and its longest life
+EVENT_STREAM_HEARTBEAT = 15
+EVENT_STREAM_TIMEOUT = GENERATION_TIMEOUT + 60
+
+def encode_cursor(created_at, user_image_id):
+    """Encode the last row of a gallery page as an opaque cursor"""
+    raw = json.dumps([created_at.isoformat(), user_image_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a cursor into its (created_at, user_image_id) keyset; raises ValueError"""
+    if not cursor:
+        return None
+    try:
+        created_at, user_image_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), str(user_image_id)
+    except (TypeError, binascii.Error, UnicodeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+# Query builders for the hot read paths, shared with init_db.py --check-indexes
+# so the plans it checks are the ones the routes run
+
+def gallery_query(user_id, filter_param='all', cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of a user's gallery plus one row, to tell whether another page follows"""
+    # One joined query, projecting only the columns the response needs
+    query = db.session.query(
+        Image.id,
+        Image.image_url,
+        Image.prompt,
+        Image.asset,
+        Image.created_at,
+        Image.updated_at,
+        UserImage.is_loved,
+        UserImage.is_saved,
+        UserImage.id.label('user_image_id'),
+        UserImage.created_at.label('added_at')
+    ).join(UserImage, UserImage.image_id == Image.id).filter(UserImage.user_id == user_id)
 
-# Create a thread pool executor for running async code
-executor = ThreadPoolExecutor(max_workers=10)
+    # Apply the filter in SQL
+    if filter_param == 'loved':
+        query = query.filter(UserImage.is_loved.is_(True))
+    elif filter_param == 'saved':
+        query = query.filter(UserImage.is_saved.is_(True))
+
+    # Newest first, keyed on (user_id, created_at, id) so pages stay stable under inserts
+    if cursor:
+        query = query.filter(tuple_(UserImage.created_at, UserImage.id) < cursor)
+    return query.order_by(UserImage.created_at.desc(), UserImage.id.desc()).limit(limit + 1)
+
+def user_image_query(user_id, image_id):
+    """A user's relationship to one image"""
+    return UserImage.query.filter_by(user_id=user_id, image_id=image_id)
+
+def image_status_query(user_id, image_urls):
+    """Images by URL, left-joined to this user's relationships"""
+    return db.session.query(
+        Image.id,
+        Image.image_url,
+        UserImage.is_loved,
+        UserImage.is_saved,
+        UserImage.id.label('user_image_id')
+    ).outerjoin(
+        UserImage,
+        (UserImage.image_id == Image.id) & (UserImage.user_id == user_id)
+    ).filter(Image.image_url.in_(image_urls))
+
+def cached_image_query(cache_key):
+    """Images generated from the same inputs, earliest first"""
+    return db.session.query(Image.id, Image.image_url).filter(
+        Image.cache_key == cache_key
+    ).order_by(Image.created_at)
 
 @images_bp.route('/', methods=['GET'])
-@token_required
+@read_only
+@claims_required
 def get_images(current_user):
     # Get filter parameter (all, loved, saved)
     filter_param = request.args.get('filter', 'all')
     
-    # Query images based on filter
-    if filter_param == 'loved':
-        user_images = UserImage.query.filter_by(user_id=current_user.id, is_loved=True).all()
-    elif filter_param == 'saved':
-        user_images = UserImage.query.filter_by(user_id=current_user.id, is_saved=True).all()
-    else:
-        user_images = UserImage.query.filter_by(user_id=current_user.id).all()
+    # Page size and keyset cursor from the previous page
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        cursor = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid limit or cursor'
+        }), 400
     
-    # Get image details
-    images = []
-    for user_image in user_images:
-        image = Image.query.get(user_image.image_id)
-        if image:
-            image_data = image.to_dict()
-            image_data['is_loved'] = user_image.is_loved
-            image_data['is_saved'] = user_image.is_saved
-            images.append(image_data)
+    # An unchanged collection answers 304 before the join runs
+    etag = collection_etag(
+        current_user.id, collection_version(current_user.id), 'images', filter_param, request.args.get('cursor'), limit
+    )
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
     
-    return jsonify({
+    rows = gallery_query(current_user.id, filter_param, cursor, limit).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].added_at, rows[-1].user_image_id)
+    
+    images = [{
+        'id': row.id,
+        'image_url': row.image_url,
+        'prompt': row.prompt,
+        **asset_store.sources(row.asset),
+        # Serialised as ISO 8601 by the app's JSON provider
+        'created_at': row.created_at,
+        'updated_at': row.updated_at,
+        'is_loved': row.is_loved,
+        'is_saved': row.is_saved
+    } for row in rows]
+    
+    return cache_validated(jsonify({
         'success': True,
-        'images': images
-    })
+        'images': images,
+        'next_cursor': next_cursor
+    }), etag)
 
 @images_bp.route('/<image_id>', methods=['GET'])
-@token_required
+@read_only
+@claims_required
 def get_image(current_user, image_id):
+    etag = collection_etag(current_user.id, collection_version(current_user.id), 'image', image_id)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+    
     # Check if user has access to this image
-    user_image = UserImage.query.filter_by(user_id=current_user.id, image_id=image_id).first()
+    user_image = user_image_query(current_user.id, image_id).first()
     
     if not user_image:
         return jsonify({
@@ -69,19 +213,19 @@ def get_image(current_user, image_id):
     image_data['is_loved'] = user_image.is_loved
     image_data['is_saved'] = user_image.is_saved
     
-    return jsonify({
+    return cache_validated(jsonify({
         'success': True,
         'image': image_data
-    })
+    }), etag)
 
 @images_bp.route('/<image_id>/love', methods=['PUT'])
-@token_required
+@claims_required
 def toggle_love_image(current_user, image_id):
     data = request.get_json()
     is_loved = data.get('isLoved', False)
     
     # Check if user has access to this image
-    user_image = UserImage.query.filter_by(user_id=current_user.id, image_id=image_id).first()
+    user_image = user_image_query(current_user.id, image_id).first()
     
     if not user_image:
         return jsonify({
@@ -91,6 +235,7 @@ def toggle_love_image(current_user, image_id):
     
     # Update is_loved status
     user_image.is_loved = is_loved
+    bump_collection_version(current_user.id)
     db.session.commit()
     
     return jsonify({
@@ -99,13 +244,13 @@ def toggle_love_image(current_user, image_id):
     })
 
 @images_bp.route('/<image_id>/save', methods=['PUT'])
-@token_required
+@claims_required
 def toggle_save_image(current_user, image_id):
     data = request.get_json()
     is_saved = data.get('isSaved', False)
     
     # Check if user has access to this image
-    user_image = UserImage.query.filter_by(user_id=current_user.id, image_id=image_id).first()
+    user_image = user_image_query(current_user.id, image_id).first()
     
     if not user_image:
         return jsonify({
@@ -115,6 +260,7 @@ def toggle_save_image(current_user, image_id):
     
     # Update is_saved status
     user_image.is_saved = is_saved
+    bump_collection_version(current_user.id)
     db.session.commit()
     
     return jsonify({
@@ -122,73 +268,79 @@ def toggle_save_image(current_user, image_id):
         'message': f'Image {"saved" if is_saved else "unsaved"} successfully'
     })
 
-# Async function to generate image with fal.ai
-async def generate_image_async(prompt):
-    print(f"Starting async image generation for prompt: {prompt}")
-    
+# Async function to generate images with the configured provider; raises on failure
+async def generate_images_async(prompt, seed=None, num_images=1, on_event=None):
+    provider = get_provider()
+    error = provider.configuration_error()
+    if error:
+        raise RuntimeError(error)
+
+    start = time.perf_counter()
     try:
-        # Set the FAL_KEY for the client
-        fal_key = os.getenv('FAL_KEY')
-        if not fal_key:
-            print("FAL_KEY environment variable is not set")
-            return None
-            
-        os.environ["FAL_KEY"] = fal_key
-        
-        # Submit the request to fal.ai
-        print(f"Submitting request to fal.ai with prompt: {prompt}")
-        handler = await fal_client.submit_async(
-            # "fal-ai/flux/dev",
-            'fal-ai/fast-lightning-sdxl',
-            data={
-                "prompt": prompt,
-                "negative_prompt": "blurry, bad quality, distorted, disfigured"
-            }
-        )
-        
+        # Submit the request to the provider
+        logger.info('Submitting request to %s', provider.name, extra={'prompt': prompt})
+        handle = await provider.submit(prompt, seed, num_images)
+
         # Wait for the result
-        print("Waiting for result...")
-        async for event in handler.iter_events(with_logs=True):
-            print(f"Event: {event}")
-        
-        # Get the final result
-        result = await handler.get()
-        print(f"Result received: {result}")
-        
-        # Extract the image URL
-        image_url = None
-        
-        # Try to extract the image URL based on different possible formats
-        if isinstance(result, dict) and 'images' in result and len(result['images']) > 0:
-            # Format: {'images': [{'url': '...'}]}
-            image_url = result['images'][0].get('url')
-        elif hasattr(result, 'images') and len(result.images) > 0:
-            # Format: result.images[0].url
-            image_url = result.images[0].url if hasattr(result.images[0], 'url') else None
-        elif hasattr(result, 'image_url'):
-            # Format: result.image_url
-            image_url = result.image_url
-        
-        if not image_url:
-            print("Could not extract image URL from result")
-            return None
-        
-        print(f"Extracted image URL: {image_url}")
-        return image_url
+        async for event in provider.events(handle):
+            log_sampled(logger, logging.DEBUG, 'Provider event: %s', event)
+            if on_event:
+                on_event(event)
+
+        # Get the final image URLs
+        image_urls = await provider.result(handle)
+        if not image_urls:
+            raise RuntimeError('Could not extract image URL from result')
+    except asyncio.CancelledError:
+        metrics.observe_upstream(provider.name, time.perf_counter() - start, 'cancelled')
+        raise
+    except Exception:
+        metrics.observe_upstream(provider.name, time.perf_counter() - start, 'error')
+        raise
+    metrics.observe_upstream(provider.name, time.perf_counter() - start)
+
+    logger.info('Generated %d images', len(image_urls), extra={'image_urls': image_urls})
+    return image_urls
+
+# Async function to generate one image; runs on the shared fal_loop
+async def generate_image_async(prompt, seed=None, on_event=None):
+    try:
+        image_urls = await generate_images_async(prompt, seed, on_event=on_event)
+        return image_urls[0]
     
     except Exception as e:
-        print(f"Error in async image generation: {str(e)}")
+        logger.warning('Error in async image generation: %s', e)
         return None
 
-# Function to run async code in a thread
-def run_async_in_thread(async_func, *args, **kwargs):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        result = loop.run_until_complete(async_func(*args, **kwargs))
-        return result
-    finally:
-        loop.close()
+# Async function to generate a batch of prompts, at most BATCH_USER_CONCURRENCY
+# at a time per user; returns a list of image URLs or an exception per prompt.
+# Prompts still running after ``timeout`` seconds are cancelled and get a
+# TimeoutError, while those that finished keep their images
+async def generate_batch_async(user_id, prompts, num_images, timeout=None):
+    # Only touched from the fal_loop thread, so no lock is needed
+    limit = _batch_limits.get(user_id)
+    if limit is None:
+        limit = asyncio.Semaphore(BATCH_USER_CONCURRENCY)
+        _batch_limits[user_id] = limit
+
+    async def generate(prompt):
+        async with limit:
+            return await fal_loop.bounded(generate_images_async, prompt, None, num_images)
+
+    tasks = [asyncio.ensure_future(generate(prompt)) for prompt in prompts]
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+
+    outcomes = []
+    for task in tasks:
+        if task in pending:
+            outcomes.append(TimeoutError('Timed out generating image'))
+        elif task.exception() is not None:
+            outcomes.append(task.exception())
+        else:
+            outcomes.append(task.result())
+    return outcomes
 
 @images_bp.route('/generate', methods=['POST'])
 @token_required
@@ -196,162 +348,529 @@ def generate_image(current_user):
     data = request.get_json()
     prompt = data.get('prompt')
 
-    prompt = prompt + 'cartoon style, vibrant colors, clean lines, flat shading, exaggerated features, playful, 2D illustration'
-
     if not prompt:
         return jsonify({
             'success': False,
             'message': 'Prompt is required'
         }), 400
 
-    try:
-        # Get FAL_KEY from environment
-        fal_key = os.getenv('FAL_KEY')
-        
-        if not fal_key:
-            return jsonify({
-                'success': False,
-                'message': 'FAL_KEY environment variable is not set'
-            }), 500
-        
-        # Set the FAL_KEY for the client
-        os.environ["FAL_KEY"] = fal_key
-        
-        # Submit the task to the executor
-        print(f"Submitting task to executor for prompt: {prompt}")
-        future = executor.submit(run_async_in_thread, generate_image_async, prompt)
-        
-        # Wait for the result with a timeout
-        try:
-            image_url = future.result(timeout=120)  # 2-minute timeout
-            print(f"Received image URL from future: {image_url}")
-        except Exception as e:
-            print(f"Error or timeout in image generation: {str(e)}")
-            return jsonify({
-                'success': False,
-                'message': f'Image generation failed: {str(e)}'
-            }), 500
-        
-        if not image_url:
+    prompt = prompt + STYLE_SUFFIX
+
+    # Opt-in reuse of an image generated earlier from the same inputs
+    use_cache = bool(data.get('useCache', False))
+    seed = data.get('seed')
+
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+        return jsonify({
+            'success': False,
+            'message': 'Seed must be an integer'
+        }), 400
+
+    cache_key = generation_cache_key(prompt, seed, get_provider().model)
+
+    if use_cache:
+        cached = find_cached_image(cache_key)
+        if cached:
+            try:
+                link_user_image(current_user.id, cached.id)
+                job = GenerationJob(user_id=current_user.id, prompt=prompt, seed=seed, use_cache=True, cache_key=cache_key)
+                job.status = 'done'
+                job.image_id = cached.id
+                db.session.add(job)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.exception('Error reusing cached image')
+                return jsonify({
+                    'success': False,
+                    'message': f'Failed to reuse cached image: {str(e)}'
+                }), 500
+
             return jsonify({
+                'success': True,
+                'jobId': job.id,
+                'status': job.status,
+                'imageId': cached.id,
+                'imageUrl': cached.image_url,
+                'cached': True,
+                'message': 'Image served from cache'
+            })
+
+    # Make sure the image provider is configured
+    error = get_provider().configuration_error()
+
+    if error:
+        return jsonify({
+            'success': False,
+            'message': error
+        }), 500
+
+    try:
+        # Persist the job first so it survives a restart, then hand it to the workers
+        job = GenerationJob(user_id=current_user.id, prompt=prompt, seed=seed, use_cache=use_cache, cache_key=cache_key)
+        db.session.add(job)
+        db.session.commit()
+        job_queue.enqueue(job.id)
+        logger.info('Queued generation job', extra={'job_id': job.id})
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Error queueing generation job')
+        return jsonify({
+            'success': False,
+            'message': f'Failed to queue image generation: {str(e)}'
+        }), 500
+
+    return jsonify({
+        'success': True,
+        'jobId': job.id,
+        'status': job.status,
+        'message': 'Image generation queued'
+    }), 202
+
+@images_bp.route('/generate/batch', methods=['POST'])
+@token_required
+def generate_image_batch(current_user):
+    data = request.get_json()
+    prompts = data.get('prompts')
+    num_images = data.get('numImages', 1)
+
+    if not isinstance(prompts, list) or not prompts:
+        return jsonify({
+            'success': False,
+            'message': 'Prompts must be a non-empty list'
+        }), 400
+
+    if len(prompts) > MAX_BATCH_PROMPTS:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_BATCH_PROMPTS} prompts can be generated at once'
+        }), 400
+
+    if not all(isinstance(prompt, str) and prompt.strip() for prompt in prompts):
+        return jsonify({
+            'success': False,
+            'message': 'Every prompt must be a non-empty string'
+        }), 400
+
+    if not isinstance(num_images, int) or isinstance(num_images, bool) or not 1 <= num_images <= MAX_IMAGES_PER_PROMPT:
+        return jsonify({
+            'success': False,
+            'message': f'numImages must be an integer from 1 to {MAX_IMAGES_PER_PROMPT}'
+        }), 400
+
+    error = get_provider().configuration_error()
+    if error:
+        return jsonify({
+            'success': False,
+            'message': error
+        }), 500
+
+    styled = [prompt + STYLE_SUFFIX for prompt in prompts]
+
+    start = time.perf_counter()
+    try:
+        # The batch itself holds no slot; each prompt takes one of fal_loop's.
+        # Prompts time out on their own, so finished ones are still saved
+        outcomes = fal_loop.run(
+            generate_batch_async,
+            current_user.id,
+            styled,
+            num_images,
+            GENERATION_TIMEOUT,
+            timeout=GENERATION_TIMEOUT + 10,
+            bounded=False
+        )
+    except TimeoutError:
+        return jsonify({
+            'success': False,
+            'message': 'Timed out generating images'
+        }), 504
+    # Upstream calls run on fal_loop, so time the wait here for Server-Timing
+    metrics.record_timing('upstream', time.perf_counter() - start)
+
+    results = []
+    image_rows = {}
+    for prompt, styled_prompt, outcome in zip(prompts, styled, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.warning('Batch generation failed: %s', outcome, extra={'prompt': prompt})
+            results.append({
+                'prompt': prompt,
                 'success': False,
-                'message': 'Failed to generate image'
-            }), 500
+                'message': str(outcome) or 'Failed to generate image'
+            })
+            continue
+
+        cache_key = generation_cache_key(styled_prompt, model=get_provider().model)
+        for image_url in outcome:
+            # Rows of one upsert must not collide, so a repeated URL keeps its first row
+            image_rows.setdefault(image_url, {
+                'id': str(uuid.uuid4()), 'image_url': image_url, 'prompt': styled_prompt, 'cache_key': cache_key
+            })
+        results.append({'prompt': prompt, 'success': True, 'images': list(outcome)})
 
-        # Create a new image in the database
+    image_ids = {}
+    if image_rows:
         try:
-            image = Image(image_url=image_url, prompt=prompt)
-            db.session.add(image)
-            db.session.flush()  # Flush to get the ID
-            
-            # Create relationship with user
-            user_image = UserImage(
-                user_id=current_user.id,
-                image_id=image.id,
-                is_loved=False,
-                is_saved=False
+            # One multi-row upsert per table for the whole batch; a URL that is
+            # already stored resolves to the existing image rather than failing
+            # the batch after the generations were paid for
+            image_ids = {
+                row.image_url: row.id
+                for row in upsert(
+                    Image,
+                    list(image_rows.values()),
+                    conflict_columns=['image_url'],
+                    returning=[Image.image_url, Image.id]
+                )
+            }
+            upsert(
+                UserImage,
+                [
+                    {'id': str(uuid.uuid4()), 'user_id': current_user.id, 'image_id': image_id,
+                     'is_loved': False, 'is_saved': False}
+                    for image_id in image_ids.values()
+                ],
+                conflict_columns=['user_id', 'image_id']
             )
-            db.session.add(user_image)
+            for image_url, image_id in image_ids.items():
+                asset_store.ingest(image_id, image_url)
+            bump_collection_version(current_user.id)
             db.session.commit()
-            print(f"Image saved to database with ID: {image.id}")
-        except Exception as db_error:
-            print(f"Database error: {str(db_error)}")
+        except Exception as e:
             db.session.rollback()
+            logger.exception('Error saving batch images')
             return jsonify({
                 'success': False,
-                'message': f'Failed to save image to database: {str(db_error)}'
+                'message': f'Failed to save generated images: {str(e)}'
             }), 500
-        
-        # Return the image URL and ID to the frontend
+
+    for result in results:
+        if result['success']:
+            result['images'] = [{'imageId': image_ids[url], 'imageUrl': url} for url in result['images']]
+
+    succeeded = sum(1 for result in results if result['success'])
+    timed_out = all(isinstance(outcome, TimeoutError) for outcome in outcomes)
+    return jsonify({
+        'success': succeeded > 0,
+        'results': results,
+        'message': f'Generated images for {succeeded} of {len(results)} prompts'
+    }), 200 if succeeded else 504 if timed_out else 502
+
+@images_bp.route('/generate/<job_id>', methods=['GET'])
+@claims_required
+def get_generation_job(current_user, job_id):
+    job = GenerationJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+
+    if not job:
         return jsonify({
-            'success': True,
-            'imageUrl': image_url,
-            'imageId': image.id,
-            'message': 'Image generated successfully'
-        })
-        
-    except Exception as e:
-        print(f"Error generating image: {str(e)}")
+            'success': False,
+            'message': 'Generation job not found'
+        }), 404
+
+    if job.status == 'done':
+        # The job finished on a worker; the gallery read that follows must see it
+        stick_to_primary()
+    return jsonify(job_status(job))
+
+@images_bp.route('/generate/<job_id>/events', methods=['GET'])
+@claims_required
+def stream_generation_job(current_user, job_id):
+    if not EVENT_STREAMS:
         return jsonify({
             'success': False,
-            'message': f'Failed to generate image: {str(e)}'
-        }), 500
+            'message': 'Event streams are disabled; poll the job instead'
+        }), 404
+
+    job = GenerationJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+
+    if not job:
+        return jsonify({
+            'success': False,
+            'message': 'Generation job not found'
+        }), 404
+
+    # Reconnecting clients resume after the last event they saw
+    try:
+        cursor = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        cursor = 0
+
+    def stream(job, cursor):
+        status = job_status(job)
+        db.session.close()
+        yield format_event('status', status, cursor)
+
+        deadline = time.monotonic() + EVENT_STREAM_TIMEOUT
+        while status['status'] not in ('done', 'failed') and time.monotonic() < deadline:
+            events, cursor = job_events.wait(job_id, cursor, timeout=EVENT_STREAM_HEARTBEAT)
+            changed = not events
+            for event_id, event in enumerate(events, cursor - len(events) + 1):
+                if event['type'] == 'status':
+                    changed = True
+                else:
+                    yield format_event(event['type'], event, event_id)
+
+            if changed:
+                # The job row is the source of truth; another process may
+                # have finished the job without publishing anything here
+                job = db.session.get(GenerationJob, job_id)
+                latest = job_status(job) if job else {'success': False, 'status': 'failed', 'message': 'Generation job not found'}
+                db.session.close()
+                if latest != status:
+                    status = latest
+                    yield format_event('status', status, cursor)
+                elif not events:
+                    yield ': keep-alive\n\n'
+
+    response = Response(stream_with_context(stream(job, cursor)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def job_status(job):
+    """The client-facing state of a generation job"""
+    response = {
+        'success': True,
+        'jobId': job.id,
+        'status': job.status,
+        'imageId': job.image_id
+    }
+
+    if job.status == 'done' and job.image_id:
+        image = Image.query.get(job.image_id)
+        response['imageUrl'] = image.image_url if image else None
+    elif job.status == 'failed':
+        response['message'] = job.error or 'Failed to generate image'
+
+    return response
+
+def format_event(event_type, data, event_id):
+    """One Server-Sent Events message"""
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n'
+
+def progress_publisher(job_id):
+    """An on_event callback forwarding fal.ai queue position and logs to a job's subscribers"""
+    seen = set()
+
+    def publish(event):
+        # fal_client yields Queued(position), InProgress(logs) and Completed(logs, metrics)
+        position = getattr(event, 'position', None)
+        if position is not None:
+            job_events.publish(job_id, {'type': 'queue', 'position': position})
+
+        for log in getattr(event, 'logs', None) or []:
+            # Status updates may repeat the logs sent so far
+            key = (log.get('timestamp'), log.get('message'))
+            if key not in seen:
+                seen.add(key)
+                job_events.publish(job_id, {'type': 'log', 'message': log.get('message')})
+
+    return publish
+
+def process_generation_job(job):
+    """Run a queued generation job; called by the job queue workers"""
+    if job.use_cache:
+        # The same inputs may have finished since this job was queued
+        cached = find_cached_image(job.cache_key)
+        if cached:
+            link_user_image(job.user_id, cached.id)
+            return cached.id
+
+    provider = get_provider()
+    webhook_url = os.getenv('FAL_WEBHOOK_URL')
+    if webhook_url and provider.supports_webhooks:
+        # fal.ai pushes the result to fal_ai_webhook, which finishes the job
+        logger.info('Submitting webhook request to %s', provider.name, extra={'job_id': job.id})
+        request_id = fal_loop.run(provider.submit_webhook, job.prompt, webhook_url, job.seed)
+        db.session.add(ImageRequest(
+            request_id=request_id,
+            user_id=job.user_id,
+            prompt=job.prompt,
+            job_id=job.id
+        ))
+        logger.info('Generation job submitted as fal.ai request %s', request_id, extra={'job_id': job.id})
+        return None
+
+    # Jobs that opted into the cache share one upstream call per set of inputs
+    # (and only the first job's subscribers see its progress)
+    image_url = fal_loop.run(
+        generate_image_async,
+        job.prompt,
+        job.seed,
+        timeout=GENERATION_TIMEOUT,
+        coalesce_key=job.cache_key if job.use_cache else None,
+        on_event=progress_publisher(job.id)
+    )
+
+    if not image_url:
+        raise RuntimeError('Failed to generate image')
+
+    # Coalesced jobs get the same URL, so insert-or-reuse the image row
+    image_id = upsert(
+        Image,
+        {'image_url': image_url, 'prompt': job.prompt, 'cache_key': job.cache_key},
+        conflict_columns=['image_url'],
+        returning=[Image.id]
+    ).scalar_one()
+
+    # Create relationship with user
+    link_user_image(job.user_id, image_id)
+    # Thumbnails are made once the job's transaction commits
+    asset_store.ingest(image_id, image_url)
+    logger.info('Image saved', extra={'job_id': job.id, 'image_id': image_id})
+    return image_id
+
+def save_image_asset(image_id, asset):
+    """Record an image's stored copy and derivatives; called by the asset store workers"""
+    Image.query.filter_by(id=image_id).update({'asset': asset}, synchronize_session=False)
+    # Galleries showing it now have a srcset
+    bump_collection_version(image_id=image_id)
+    db.session.commit()
+
+def find_cached_image(cache_key):
+    """The earliest image generated from the same inputs, if any"""
+    return cached_image_query(cache_key).first()
+
+def link_user_image(user_id, image_id):
+    """Give a user an image, keeping their flags if they already have it"""
+    upsert(
+        UserImage,
+        {'user_id': user_id, 'image_id': image_id, 'is_loved': False, 'is_saved': False},
+        conflict_columns=['user_id', 'image_id']
+    )
+    bump_collection_version(user_id)
+
+@images_bp.route('/local/<token>.png', methods=['GET'])
+def get_local_image(token):
+    # Images from the local provider are drawn from their token on request
+    if not re.fullmatch(r'[0-9a-f]{32}', token):
+        return jsonify({
+            'success': False,
+            'message': 'Image not found'
+        }), 404
+
+    # The token determines the image, so it doubles as a strong ETag
+    if token in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(render_png(token), mimetype='image/png')
+    response.set_etag(token)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@images_bp.route('/assets/<path:name>', methods=['GET'])
+def get_asset(name):
+    # Stored images, thumbnails and avatars; names are content hashes, so they never change
+    if not ASSET_NAME.fullmatch(name):
+        return jsonify({
+            'success': False,
+            'message': 'Image not found'
+        }), 404
+
+    response = asset_store.storage.send(name)
+    if response is None:
+        return jsonify({
+            'success': False,
+            'message': 'Image not found'
+        }), 404
+    return response
+
+@images_bp.route('/predefined', methods=['GET'])
+def get_predefined_images():
+    # Served from the catalog loaded at startup; unchanged catalogs answer 304
+    response = Response(predefined_catalog.body, mimetype='application/json')
+    response.set_etag(predefined_catalog.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
 
 @images_bp.route('/predefined/save', methods=['POST'])
 @token_required
 def save_predefined_image(current_user):
     data = request.get_json()
+    slug = data.get('slug')
     image_url = data.get('imageUrl')
     prompt = data.get('prompt')
-    is_loved = data.get('isLoved', False)
-    is_saved = data.get('isSaved', False)
+    is_loved = data.get('isLoved')
+    is_saved = data.get('isSaved')
     
-    if not image_url or not prompt:
+    # Catalog images are seeded at startup, so their id comes from memory
+    entry = predefined_catalog.get(slug=slug, image_url=image_url)
+    
+    if slug and not entry:
+        return jsonify({
+            'success': False,
+            'message': f'Unknown predefined image: {slug}'
+        }), 404
+    
+    if not entry and (not image_url or not prompt):
         return jsonify({
             'success': False,
             'message': 'Image URL and prompt are required'
         }), 400
     
     try:
-        # Check if the image already exists in the database
-        existing_image = Image.query.filter_by(image_url=image_url).first()
-        
-        if existing_image:
-            # Image exists, check if user already has a relationship with it
-            user_image = UserImage.query.filter_by(
-                user_id=current_user.id,
-                image_id=existing_image.id
-            ).first()
-            
-            if user_image:
-                # Update existing relationship
-                if is_loved is not None:
-                    user_image.is_loved = is_loved
-                if is_saved is not None:
-                    user_image.is_saved = is_saved
-            else:
-                # Create new relationship
-                user_image = UserImage(
-                    user_id=current_user.id,
-                    image_id=existing_image.id,
-                    is_loved=is_loved,
-                    is_saved=is_saved
-                )
-                db.session.add(user_image)
+        if entry:
+            image_id = entry['id']
         else:
-            # Image doesn't exist, create it first
-            new_image = Image(image_url=image_url, prompt=prompt)
-            db.session.add(new_image)
-            db.session.flush()  # Get the ID
-            
-            # Create relationship
-            user_image = UserImage(
-                user_id=current_user.id,
-                image_id=new_image.id,
-                is_loved=is_loved,
-                is_saved=is_saved
-            )
-            db.session.add(user_image)
+            # Insert the image, or pick up the existing row with this URL
+            image_id = upsert(
+                Image,
+                {'image_url': image_url, 'prompt': prompt},
+                conflict_columns=['image_url'],
+                returning=[Image.id]
+            ).scalar_one()
+        
+        # Only the flags sent in the request change an existing relationship
+        flags = {}
+        if is_loved is not None:
+            flags['is_loved'] = bool(is_loved)
+        if is_saved is not None:
+            flags['is_saved'] = bool(is_saved)
+        
+        user_image = upsert(
+            UserImage,
+            dict({'user_id': current_user.id, 'image_id': image_id, 'is_loved': False, 'is_saved': False}, **flags),
+            conflict_columns=['user_id', 'image_id'],
+            update_columns=list(flags),
+            extra_updates={'updated_at': datetime.utcnow()},
+            returning=[UserImage.is_loved, UserImage.is_saved]
+        ).one()
+        bump_collection_version(current_user.id)
         
         db.session.commit()
         
         return jsonify({
             'success': True,
-            'message': f"Image {'loved' if is_loved else ''} {'saved' if is_saved else ''} successfully"
+            'message': f"Image {'loved' if user_image.is_loved else ''} {'saved' if user_image.is_saved else ''} successfully",
+            'imageId': image_id,
+            'isLoved': user_image.is_loved,
+            'isSaved': user_image.is_saved
         })
     
     except Exception as e:
         db.session.rollback()
-        print(f"Error saving predefined image: {str(e)}")
+        logger.exception('Error saving predefined image')
         return jsonify({
             'success': False,
             'message': f'Error saving image: {str(e)}'
         }), 500
 
 @images_bp.route('/predefined/status', methods=['GET'])
-@token_required
+@read_only
+@claims_required
 def get_predefined_image_status(current_user):
     image_url = request.args.get('imageUrl')
+    slug = request.args.get('slug')
+    
+    if slug:
+        entry = predefined_catalog.get(slug=slug)
+        if not entry:
+            return jsonify({
+                'success': False,
+                'message': f'Unknown predefined image: {slug}'
+            }), 404
+        image_url = entry['imageUrl']
     
     if not image_url:
         return jsonify({
@@ -400,8 +919,66 @@ def get_predefined_image_status(current_user):
         })
     
     except Exception as e:
-        print(f"Error getting predefined image status: {str(e)}")
+        logger.exception('Error getting predefined image status')
         return jsonify({
             'success': False,
             'message': f'Error getting image status: {str(e)}'
-        }), 500
\ No newline at end of file
+        }), 500
+
+@images_bp.route('/predefined/status', methods=['POST'])
+@read_only
+@claims_required
+def get_predefined_image_statuses(current_user):
+    data = request.get_json(silent=True) or {}
+    # Statuses are keyed by whatever the caller sent: catalog slugs or image URLs
+    keys = data.get('slugs') if 'slugs' in data else data.get('imageUrls')
+    
+    if not isinstance(keys, list) or not keys or not all(isinstance(key, str) for key in keys):
+        return jsonify({
+            'success': False,
+            'message': 'imageUrls (or slugs) must be a non-empty list'
+        }), 400
+    
+    if len(keys) > MAX_STATUS_BATCH:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_STATUS_BATCH} images can be checked at once'
+        }), 400
+    
+    if 'slugs' in data:
+        entries = {slug: predefined_catalog.get(slug=slug) for slug in keys}
+        image_urls = {slug: entry['imageUrl'] for slug, entry in entries.items() if entry}
+    else:
+        image_urls = {image_url: image_url for image_url in keys}
+    
+    try:
+        # One query for every URL: images left-joined to this user's relationships
+        rows = image_status_query(current_user.id, set(image_urls.values())).all()
+        
+        found = {row.image_url: row for row in rows}
+        statuses = {}
+        for key in keys:
+            row = found.get(image_urls.get(key))
+            if not row:
+                statuses[key] = {'exists': False, 'isLoved': False, 'isSaved': False}
+            elif not row.user_image_id:
+                statuses[key] = {'exists': True, 'isLoved': False, 'isSaved': False}
+            else:
+                statuses[key] = {
+                    'exists': True,
+                    'isLoved': row.is_loved,
+                    'isSaved': row.is_saved,
+                    'imageId': row.id
+                }
+        
+        return jsonify({
+            'success': True,
+            'statuses': statuses
+        })
+    
+    except Exception as e:
+        logger.exception('Error getting predefined image statuses')
+        return jsonify({
+            'success': False,
+            'message': f'Error getting image statuses: {str(e)}'
+        }), 500
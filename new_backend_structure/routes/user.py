@@ -1,25 +1,64 @@
 from flask import Blueprint, request, jsonify
 from models import db, User, UserImage
-from utils.auth import token_required
-import base64
+from utils.auth import token_required, invalidate_user
+from utils.replica import read_only
+from utils.avatars import AVATAR_MAX_BYTES, avatar_store
+from utils.collection import bump_collection_version, cache_validated, collection_etag, not_modified
+import logging
 import os
-import uuid
 
 user_bp = Blueprint('user', __name__)
+logger = logging.getLogger(__name__)
+
+# Room for the multipart boundaries and headers around the avatar file
+MULTIPART_OVERHEAD = 64 * 1024
+
+def lock_avatar(user_id):
+    """Lock a user's row until the transaction ends; returns their avatar URL.
+
+    Uploads hold it, and avatar_store.user_lock within the process, from
+    saving their files until the profile points at them, so overlapping
+    uploads take turns.
+    """
+    return db.session.query(User.avatar_url).filter(User.id == user_id).with_for_update().scalar()
+
+def remove_superseded_avatars(user_id, old_avatar_url):
+    """Delete avatar files a user's profile no longer points at; commits"""
+    # No upload is in flight while we hold the locks, so every file but the
+    # profile's current avatar can go
+    with avatar_store.user_lock(user_id):
+        avatar_url = lock_avatar(user_id)
+        avatar_store.collect(user_id, keep=avatar_url)
+        db.session.commit()
+    # Avatars saved by the old base64 upload, relative to the working directory
+    if old_avatar_url and old_avatar_url != avatar_url and old_avatar_url.startswith(f'/static/avatars/avatar_{user_id}_'):
+        try:
+            os.remove(old_avatar_url.lstrip('/'))
+        except OSError:
+            pass
 
 @user_bp.route('/profile', methods=['GET'])
+@read_only
 @token_required
 def get_profile(current_user):
-    return jsonify({
+    # The user comes from the user cache, so a 304 costs no query at all
+    etag = collection_etag(current_user.id, current_user.collection_version, 'profile', current_user.updated_at)
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
+    return cache_validated(jsonify({
         'success': True,
         'user': current_user.to_dict()
-    })
+    }), etag)
 
 @user_bp.route('/profile', methods=['PUT'])
 @token_required
 def update_profile(current_user):
     data = request.get_json()
-    print(data)
+    logger.debug('Profile update', extra={'fields': sorted(data or {})})
+
+    old_avatar_url = current_user.avatar_url
 
     # Update fields if provided
     if 'name' in data:
@@ -32,34 +71,70 @@ def update_profile(current_user):
         # If it's a fal.ai URL, just store it directly
         if avatar_url and (avatar_url.startswith('https://') or avatar_url.startswith('https://')):
             current_user.avatar_url = avatar_url
-        # If it's a base64 string, process it as before
+        # Image files are uploaded to upload_avatar instead
         elif avatar_url and avatar_url.startswith('data:image'):
-            try:
-                # Extract the base64 data
-                format, imgstr = avatar_url.split(';base64,')
-                ext = format.split('/')[-1]
-                
-                # Create a unique filename
-                filename = f"avatar_{current_user.id}_{uuid.uuid4()}.{ext}"
-                filepath = os.path.join('static', 'avatars', filename)
-                
-                # Ensure the directory exists
-                os.makedirs(os.path.join('static', 'avatars'), exist_ok=True)
-                
-                # Save the image
-                with open(filepath, "wb") as f:
-                    f.write(base64.b64decode(imgstr))
-                
-                # Update the avatar URL to point to the saved file
-                current_user.avatar_url = f"/static/avatars/{filename}"
-            except Exception as e:
-                print(f"Error saving avatar: {str(e)}")
-                return jsonify({
-                    'success': False,
-                    'message': f'Failed to save avatar: {str(e)}'
-                }), 500
+            return jsonify({
+                'success': False,
+                'message': 'Upload avatar images as multipart/form-data to /api/user/avatar'
+            }), 400
 
+    bump_collection_version(current_user.id)
     db.session.commit()
+    invalidate_user(current_user.id)
+    if current_user.avatar_url != old_avatar_url:
+        remove_superseded_avatars(current_user.id, old_avatar_url)
+
+    return jsonify({
+        'success': True,
+        'message': 'Profile photo updated successfully',
+        'user': current_user.to_dict()
+    })
+
+@user_bp.route('/avatar', methods=['POST'])
+@token_required
+def upload_avatar(current_user):
+    # Refuse oversized uploads from the header, before any of the body is read
+    if request.content_length is None:
+        return jsonify({
+            'success': False,
+            'message': 'Content-Length is required'
+        }), 411
+
+    if request.content_length > AVATAR_MAX_BYTES + MULTIPART_OVERHEAD:
+        return jsonify({
+            'success': False,
+            'message': f'Avatar must be at most {AVATAR_MAX_BYTES // (1024 * 1024)} MB'
+        }), 413
+
+    # Werkzeug reads the body in chunks and spools file parts over 500 KB to disk
+    upload = request.files.get('avatar')
+    if not upload:
+        return jsonify({
+            'success': False,
+            'message': 'An avatar file is required'
+        }), 400
+
+    # Held until the old files are gone (AvatarBusy is answered by the
+    # app's 429 handler, and the row lock released with the session)
+    with avatar_store.user_lock(current_user.id):
+        old_avatar_url = lock_avatar(current_user.id)
+        try:
+            avatar_url = avatar_store.save(current_user.id, upload.stream)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        finally:
+            upload.close()
+
+        current_user.avatar_url = avatar_url
+        bump_collection_version(current_user.id)
+        db.session.commit()
+        invalidate_user(current_user.id)
+        # Only once the profile points at the new files
+        remove_superseded_avatars(current_user.id, old_avatar_url)
 
     return jsonify({
         'success': True,
@@ -90,7 +165,9 @@ def update_password(current_user):
 
     # Update password
     current_user.set_password(new_password)
+    bump_collection_version(current_user.id)
     db.session.commit()
+    invalidate_user(current_user.id)
 
     return jsonify({
         'success': True,
@@ -111,8 +188,12 @@ def delete_account(current_user):
     UserImage.query.filter_by(user_id=current_user.id).delete()
 
     # Delete user
+    user_id = current_user.id
+    avatar_url = current_user.avatar_url
     db.session.delete(current_user)
     db.session.commit()
+    invalidate_user(user_id)
+    remove_superseded_avatars(user_id, avatar_url)
 
     return jsonify({
         'success': True,
@@ -1,76 +1,77 @@
 from flask import Blueprint, request, jsonify
-from models import db, Image, ImageRequest, UserImage
-import os
-import time
-import json
-import hmac
-import hashlib
+from sqlalchemy import and_, or_
+from models import db, Image, ImageRequest, UserImage, GenerationJob
+from utils.fal import extract_image_url, verify_webhook_signature
+from utils.events import job_events
+from utils.assets import asset_store
+from utils.collection import bump_collection_version
+from datetime import datetime
+import logging
 
 webhooks_bp = Blueprint('webhooks', __name__)
-
-# Helper function to verify webhook signature
-def verify_webhook_signature(request_data, signature_header):
-    # This is a placeholder - you would implement proper signature verification
-    # based on fal.ai's webhook signature method
-    webhook_secret = os.getenv('FAL_WEBHOOK_SECRET', '')
-    
-    if not webhook_secret:
-        # For development, you might skip verification
-        return True
-    
-    # Example implementation (adjust based on fal.ai's actual signature method)
-    computed_signature = hmac.new(
-        webhook_secret.encode('utf-8'),
-        request_data,
-        hashlib.sha256
-    ).hexdigest()
-    
-    return hmac.compare_digest(computed_signature, signature_header)
+logger = logging.getLogger(__name__)
 
 @webhooks_bp.route('/fal-ai', methods=['POST'])
 def fal_ai_webhook():
-    # Get the raw request data for signature verification
-    request_data = request.get_data()
-    signature_header = request.headers.get('X-Fal-Signature', '')
-    
-    # Verify the webhook signature (optional but recommended for production)
-    # if not verify_webhook_signature(request_data, signature_header):
-    #     return jsonify({
-    #         'success': False,
-    #         'message': 'Invalid webhook signature'
-    #     }), 401
+    # Verify fal.ai's signature over the raw body (skipped with FAL_WEBHOOK_VERIFY=false)
+    if not verify_webhook_signature(request.headers, request.get_data()):
+        return jsonify({
+            'success': False,
+            'message': 'Invalid webhook signature'
+        }), 401
     
     # Parse the JSON data
     data = request.get_json()
-    print(f"Received webhook from fal.ai: {data}")
+    logger.info('Received webhook from fal.ai', extra={'request_id': data.get('request_id'), 'status': data.get('status')})
+    logger.debug('Webhook payload: %s', data)
     
-    # Extract the request ID and result
+    # Extract the request ID and result (fal.ai sends the result as 'payload')
     request_id = data.get('request_id')
-    result = data.get('result')
-    error = data.get('error')
+    result = data.get('payload', data.get('result'))
+    error = data.get('error') or (data.get('status') == 'ERROR')
     
-    if not request_id:
-        print("No request_id in webhook data")
+    signed_request_id = request.headers.get('X-Fal-Webhook-Request-Id')
+    if not request_id or (signed_request_id and signed_request_id != request_id):
+        logger.warning('No request_id in webhook data')
         return jsonify({
             'success': False,
             'message': 'Missing request_id'
         }), 400
     
-    # Find the corresponding image request
+    # Claim the pending request atomically; fal.ai may deliver the same webhook
+    # more than once, and only the first delivery should create an image
+    claimed = ImageRequest.query.filter_by(request_id=request_id, status='pending').update(
+        {'status': 'processing', 'updated_at': datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    
     image_request = ImageRequest.query.filter_by(request_id=request_id).first()
     
     if not image_request:
-        print(f"No image request found for request_id: {request_id}")
-        return jsonify({
+        # The worker that submitted it may not have committed the request
+        # yet; fal.ai retries deliveries that fail, so ask for another try
+        logger.warning('No image request found for request_id: %s', request_id)
+        response = jsonify({
             'success': False,
             'message': 'Image request not found'
-        }), 404
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    if not claimed:
+        logger.info('Duplicate webhook for request_id: %s', request_id)
+        return jsonify({
+            'success': True,
+            'message': f'Webhook already processed ({image_request.status})'
+        })
+    
+    job = GenerationJob.query.get(image_request.job_id) if image_request.job_id else None
     
     # Handle error case
     if error:
-        print(f"Error in fal.ai response: {error}")
-        image_request.status = 'failed'
-        db.session.commit()
+        logger.warning('Error in fal.ai response: %s', error)
+        mark_failed(image_request, job, f'fal.ai error: {error}')
         return jsonify({
             'success': True,
             'message': 'Error status recorded'
@@ -79,34 +80,22 @@ def fal_ai_webhook():
     # Handle success case
     try:
         # Extract the image URL from the result
-        image_url = None
-        
-        # Try to extract the image URL based on different possible formats
-        if isinstance(result, dict) and 'images' in result and len(result['images']) > 0:
-            # Format: {'images': [{'url': '...'}]}
-            image_url = result['images'][0].get('url')
-        elif hasattr(result, 'images') and len(result.images) > 0:
-            # Format: result.images[0].url
-            image_url = result.images[0].url if hasattr(result.images[0], 'url') else None
-        elif hasattr(result, 'image_url'):
-            # Format: result.image_url
-            image_url = result.image_url
+        image_url = extract_image_url(result)
         
         if not image_url:
-            print("Could not extract image URL from result")
-            image_request.status = 'failed'
-            db.session.commit()
+            logger.error('Could not extract image URL from result')
+            mark_failed(image_request, job, 'No image URL found in the result')
             return jsonify({
                 'success': False,
                 'message': 'No image URL found in the result'
             }), 500
         
-        print(f"Extracted image URL: {image_url}")
         
         # Create a new image
-        image = Image(image_url=image_url, prompt=image_request.prompt)
+        image = Image(image_url=image_url, prompt=image_request.prompt, cache_key=job.cache_key if job else None)
         db.session.add(image)
         db.session.flush()  # Flush to get the ID
+        asset_store.ingest(image.id, image_url)
         
         # Create relationship with user
         user_image = UserImage(
@@ -116,11 +105,17 @@ def fal_ai_webhook():
             is_saved=False
         )
         db.session.add(user_image)
+        bump_collection_version(image_request.user_id)
         
-        # Update the image request
+        # Update the image request and the job waiting on it
         image_request.status = 'completed'
         image_request.image_id = image.id
+        if job:
+            job.status = 'done'
+            job.image_id = image.id
         db.session.commit()
+        if job:
+            job_events.publish(job.id, {'type': 'status', 'status': 'done'})
         
         return jsonify({
             'success': True,
@@ -128,10 +123,49 @@ def fal_ai_webhook():
         })
     
     except Exception as e:
-        print(f"Error processing webhook: {str(e)}")
-        image_request.status = 'failed'
-        db.session.commit()
+        logger.exception('Error processing webhook')
+        db.session.rollback()
+        mark_failed(image_request, job, str(e))
         return jsonify({
             'success': False,
             'message': f'Error processing webhook: {str(e)}'
         }), 500
+
+def mark_failed(image_request, job, message):
+    image_request.status = 'failed'
+    if job:
+        job.status = 'failed'
+        job.error = message
+    db.session.commit()
+    if job:
+        job_events.publish(job.id, {'type': 'status', 'status': 'failed'})
+
+def expire_stale_requests(cutoff):
+    """Fail webhook requests still unanswered at ``cutoff``, and the jobs waiting on them.
+
+    Covers webhooks that never arrive and deliveries that gave up while
+    the request was still unknown. A late webhook for an expired request
+    is treated as a duplicate.
+    """
+    stale = db.session.query(ImageRequest.id).filter(
+        or_(
+            and_(ImageRequest.status == 'pending', ImageRequest.created_at < cutoff),
+            # A delivery that died halfway through
+            and_(ImageRequest.status == 'processing', ImageRequest.updated_at < cutoff)
+        )
+    ).all()
+
+    for (request_pk,) in stale:
+        # Another process's sweep, or the webhook, may get there first
+        expired = ImageRequest.query.filter(
+            ImageRequest.id == request_pk,
+            ImageRequest.status.in_(['pending', 'processing'])
+        ).update({'status': 'failed'}, synchronize_session=False)
+        db.session.commit()
+        if not expired:
+            continue
+
+        image_request = ImageRequest.query.get(request_pk)
+        job = GenerationJob.query.get(image_request.job_id) if image_request.job_id else None
+        logger.warning('No fal.ai webhook for request %s; giving up', image_request.request_id)
+        mark_failed(image_request, job, 'Timed out waiting for fal.ai')
@@ -0,0 +1,292 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from flask import Response, request, send_file
+from sqlalchemy import event
+from utils.metrics import Counter, Histogram, metrics
+from utils.providers import LOCAL_IMAGE_URL, render_png
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # Originals are still stored, just without derivatives
+    PILImage = None
+
+logger = logging.getLogger(__name__)
+
+# Asset storage configuration
+ASSET_STORAGE_DIR = os.getenv('ASSET_STORAGE_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'assets'))
+# Public URL prefix of the stored files; point it at a CDN or object store bucket if they are synced there
+ASSET_URL = os.getenv('ASSET_URL', '/api/images/assets/')
+# Derivative widths in pixels, and formats in order of preference
+ASSET_WIDTHS = [int(width) for width in os.getenv('ASSET_WIDTHS', '256,512,1024').split(',') if width.strip()]
+ASSET_FORMATS = [fmt.strip().lower() for fmt in os.getenv('ASSET_FORMATS', 'webp,avif').split(',') if fmt.strip()]
+ASSET_QUALITY = int(os.getenv('ASSET_QUALITY', 80))
+ASSET_WORKERS = int(os.getenv('ASSET_WORKERS', 2))
+# Largest upstream image fetched, in bytes, and how long fetching it may take
+ASSET_MAX_BYTES = int(os.getenv('ASSET_MAX_BYTES', 20 * 1024 * 1024))
+ASSET_FETCH_TIMEOUT = float(os.getenv('ASSET_FETCH_TIMEOUT', 30))
+# Internal location of a fronting nginx that maps onto ASSET_STORAGE_DIR; when
+# set, responses carry X-Accel-Redirect and nginx sends the file itself
+ASSET_ACCEL_REDIRECT = os.getenv('ASSET_ACCEL_REDIRECT')
+# Stored files never change, so clients may keep them for a year
+ASSET_MAX_AGE = 31536000
+
+MIME_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+
+assets_ingested = metrics.register(Counter(
+    'assets_ingested_total', 'Generated images ingested into the asset store, by outcome', ['outcome']))
+asset_ingest_seconds = metrics.register(Histogram(
+    'asset_ingest_seconds', 'Time to fetch, store and resize one image'))
+
+
+def sniff_format(data):
+    """'png', 'jpeg' or 'webp' from an image's magic bytes, or None"""
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def supported_formats(formats=ASSET_FORMATS):
+    """The configured derivative formats this Pillow build can encode"""
+    if PILImage is None:
+        return []
+    PILImage.init()
+    return [fmt for fmt in formats if fmt.upper() in PILImage.SAVE]
+
+
+class LocalStorage:
+    """Files under ``root``, published at ``url``.
+
+    Names are content-addressed, so a file is written once and never
+    changes; writes go through a temporary file and a rename so readers
+    never see a partial one.
+    """
+
+    def __init__(self, root=ASSET_STORAGE_DIR, url=ASSET_URL):
+        self.root = root
+        self.url_prefix = url
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def url(self, name):
+        return self.url_prefix + name
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def write(self, name, data):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def list(self, prefix):
+        """Names of the files directly under ``prefix``"""
+        try:
+            return [f'{prefix}/{entry}' for entry in os.listdir(self.path(prefix)) if not entry.startswith('.')]
+        except FileNotFoundError:
+            return []
+
+    def delete(self, name):
+        try:
+            os.unlink(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def send(self, name):
+        """A response for the file ``name``, or None if there is no such file.
+
+        The ETag comes from the content hash in the name, so it holds across
+        processes and restores from backup. Conditional and Range requests
+        are answered by send_file, which hands the file to the server's
+        ``wsgi.file_wrapper`` (sendfile under gunicorn) or, with
+        USE_X_SENDFILE, to the web server; with ASSET_ACCEL_REDIRECT only
+        the headers are sent and nginx transfers the file.
+        """
+        path = self.path(name)
+        if not os.path.isfile(path):
+            return None
+
+        etag = asset_etag(name)
+        mimetype = MIME_TYPES.get(name.rsplit('.', 1)[-1], 'application/octet-stream')
+        if ASSET_ACCEL_REDIRECT:
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = ASSET_ACCEL_REDIRECT + name
+            response.set_etag(etag)
+            response = response.make_conditional(request)
+        else:
+            response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=ASSET_MAX_AGE)
+        response.accept_ranges = 'bytes'
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+
+def asset_etag(name):
+    """Strong ETag for a stored file: its content hash and variant"""
+    directory, _, filename = name.rpartition('/')
+    digest = directory.rpartition('/')[2]
+    # Thumbnails sit in a directory named by the hash; avatars carry it in the filename
+    return f'{digest}-{filename}' if len(digest) == 64 else filename
+
+
+def original_name(key, fmt):
+    return f'{key[:2]}/{key}/original.{fmt}'
+
+
+def variant_name(key, width, fmt):
+    return f'{key[:2]}/{key}/{width}w.{fmt}'
+
+
+class AssetStore:
+    """Copies generated images into content-addressed storage with resized derivatives.
+
+    ``ingest`` queues an image once the current transaction commits. A
+    thread pool fetches it, stores the original under its SHA-256 and
+    renders each of ``widths`` (no wider than the original, plus the
+    original width) in each supported format. ``handler(image_id, asset)``
+    then records the result, which ``sources`` turns into srcsets.
+    Identical images share one set of files.
+    """
+
+    def __init__(self, storage=None, widths=ASSET_WIDTHS, formats=ASSET_FORMATS, workers=ASSET_WORKERS):
+        self.storage = storage or LocalStorage()
+        self.widths = sorted(set(widths))
+        self.formats = supported_formats(formats)
+        self.unsupported = [fmt for fmt in formats if fmt not in self.formats]
+        self.workers = workers
+        self.app = None
+        self.db = None
+        self.handler = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, db, handler):
+        self.app = app
+        self.db = db
+        self.handler = handler
+        if PILImage is None:
+            logger.warning('Pillow is not installed; images are stored without thumbnails')
+        elif self.unsupported:
+            logger.warning('Pillow cannot encode %s; skipping those derivatives', ', '.join(self.unsupported))
+
+        @event.listens_for(db.session, 'after_commit')
+        def submit_pending(session):
+            for image_id, image_url in session.info.pop('pending_assets', []):
+                self._get_pool().submit(self._run, image_id, image_url)
+
+        @event.listens_for(db.session, 'after_rollback')
+        def drop_pending(session):
+            session.info.pop('pending_assets', None)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='asset-worker')
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def ingest(self, image_id, image_url):
+        """Store an image once the current transaction commits; URLs that cannot be fetched are ignored"""
+        if self.app is None or not image_url.startswith(('http://', 'https://', LOCAL_IMAGE_URL)):
+            return
+        self.db.session.info.setdefault('pending_assets', []).append((image_id, image_url))
+
+    def fetch(self, image_url):
+        if image_url.startswith(LOCAL_IMAGE_URL):
+            return render_png(image_url[len(LOCAL_IMAGE_URL):].removesuffix('.png'))
+
+        with requests.get(image_url, stream=True, timeout=ASSET_FETCH_TIMEOUT) as response:
+            response.raise_for_status()
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > ASSET_MAX_BYTES:
+                    raise ValueError(f'Image is larger than {ASSET_MAX_BYTES} bytes')
+        return bytes(data)
+
+    def store(self, data):
+        """Store an image and its derivatives; returns the asset description"""
+        fmt = sniff_format(data)
+        if fmt is None:
+            raise ValueError('Not a PNG, JPEG or WebP image')
+        key = hashlib.sha256(data).hexdigest()
+        asset = {'key': key, 'format': fmt, 'widths': [], 'formats': []}
+
+        if not self.storage.exists(original_name(key, fmt)):
+            self.storage.write(original_name(key, fmt), data)
+        if not self.formats:
+            return asset
+
+        with PILImage.open(io.BytesIO(data)) as image:
+            alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if alpha else 'RGB')
+            width, height = image.size
+            widths = [w for w in self.widths if w < width] + [width]
+            # Largest first, so each resize starts from the closest size
+            source = image
+            for w in reversed(widths):
+                names = {variant: variant_name(key, w, variant) for variant in self.formats}
+                missing = [variant for variant, name in names.items() if not self.storage.exists(name)]
+                if w != source.width:
+                    source = source.resize((w, max(round(height * w / width), 1)), PILImage.LANCZOS, reducing_gap=3.0)
+                for variant in missing:
+                    buffer = io.BytesIO()
+                    source.save(buffer, variant.upper(), quality=ASSET_QUALITY)
+                    self.storage.write(names[variant], buffer.getvalue())
+
+        asset['widths'] = widths
+        asset['formats'] = list(self.formats)
+        return asset
+
+    def _run(self, image_id, image_url):
+        start = time.perf_counter()
+        try:
+            asset = self.store(self.fetch(image_url))
+            with self.app.app_context():
+                self.handler(image_id, asset)
+            assets_ingested.inc(outcome='stored')
+            asset_ingest_seconds.observe(time.perf_counter() - start)
+        except Exception as e:
+            assets_ingested.inc(outcome='failed')
+            logger.warning('Could not store image assets: %s', e, extra={'image_id': image_id})
+
+    def sources(self, asset):
+        """{'srcset', 'sources'} for an asset description; both empty when there are no derivatives.
+
+        ``srcset`` uses the first configured format; ``sources`` lists one
+        srcset per format, most preferred first, for a <picture> element.
+        """
+        if not asset or not asset.get('widths'):
+            return {'srcset': None, 'sources': []}
+        sources = [{
+            'type': MIME_TYPES[fmt],
+            'srcset': ', '.join(f'{self.storage.url(variant_name(asset["key"], w, fmt))} {w}w' for w in asset['widths'])
+        } for fmt in asset['formats']]
+        return {'srcset': sources[0]['srcset'], 'sources': sources}
+
+
+asset_store = AssetStore()
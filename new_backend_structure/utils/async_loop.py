@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import TimeoutError
+
+
+class BackgroundLoop:
+    """A long-lived asyncio event loop running on its own daemon thread.
+
+    Coroutines from any (sync) thread are scheduled onto the one loop with
+    ``run_coroutine_threadsafe``, so clients created on it keep their
+    connection pools between calls. At most ``max_concurrency`` coroutines
+    run at once; the rest wait on the semaphore inside the loop. Calls
+    sharing a ``coalesce_key`` while one is in flight all await that one
+    call instead of starting their own. Coroutines that fan out further
+    calls can run unbounded and wrap each call in ``bounded`` instead.
+    Coroutines see the caller's context variables (e.g. the log
+    correlation id).
+    """
+
+    def __init__(self, max_concurrency=10, name='background-loop'):
+        self.max_concurrency = max_concurrency
+        self.name = name
+        self.loop = None
+        self._semaphore = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is not None:
+                return self.loop
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=run, name=self.name, daemon=True).start()
+            ready.wait()
+            self.loop = loop
+            return loop
+
+    async def bounded(self, async_func, *args, **kwargs):
+        """Await ``async_func(*args, **kwargs)`` under the loop's concurrency cap"""
+        async with self._semaphore:
+            return await async_func(*args, **kwargs)
+
+    async def _coalesced(self, key, async_func, *args, **kwargs):
+        # Only touched from the loop thread, so no lock is needed
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.bounded(async_func, *args, **kwargs))
+            self._inflight[key] = task
+
+            def forget(done):
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+
+            task.add_done_callback(forget)
+        # A waiter timing out must not cancel the call the others share
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _in_context(context, coro):
+        # Tasks start from the loop thread's context; copy the caller's in
+        for var, value in context.items():
+            var.set(value)
+        return await coro
+
+    def submit(self, async_func, *args, coalesce_key=None, bounded=True, **kwargs):
+        """Schedule ``async_func(*args, **kwargs)`` and return a concurrent Future"""
+        loop = self.start()
+        if not bounded:
+            coro = async_func(*args, **kwargs)
+        elif coalesce_key is None:
+            coro = self.bounded(async_func, *args, **kwargs)
+        else:
+            coro = self._coalesced(coalesce_key, async_func, *args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(self._in_context(contextvars.copy_context(), coro), loop)
+
+    def run(self, async_func, *args, timeout=None, coalesce_key=None, bounded=True, **kwargs):
+        """Run ``async_func(*args, **kwargs)`` on the loop and wait for its result"""
+        future = self.submit(async_func, *args, coalesce_key=coalesce_key, bounded=bounded, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self):
+        with self._lock:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.loop = None
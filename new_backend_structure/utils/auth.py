@@ -1,9 +1,15 @@
 import jwt
 import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify
-from models import User
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from models import db, User
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -12,6 +18,78 @@ JWT_SECRET = os.getenv('JWT_SECRET', 'default-secret-key')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_DELTA = timedelta(days=7)
 
+# Authenticated user cache configuration
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))  # seconds
+
+# What claims-only routes get as current_user
+TokenUser = namedtuple('TokenUser', ['id'])
+
+class UserCache:
+    """TTL + LRU cache of user rows keyed by user id.
+
+    Holds plain column values rather than ORM objects, so an entry never
+    belongs to a session. The cache is per process; other processes see a
+    change once the TTL runs out.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, values = entry
+            if expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return values
+
+    def set(self, user_id, values):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+user_cache = UserCache()
+
+def invalidate_user(user_id):
+    """Drop a user from the cache; call after committing any change to the user"""
+    user_cache.invalidate(user_id)
+
+def load_user(user_id):
+    """Load a user, from the cache when possible"""
+    values = user_cache.get(user_id)
+    if values is None:
+        user = User.query.get(user_id)
+        # A replica row may lag the primary; write routes must not pick it
+        # up from the cache (e.g. an old password hash)
+        if user and not db.session().reads_from_replica():
+            user_cache.set(user_id, {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+        return user
+
+    # Rebuild the row from the cached values and attach it without a query
+    user = inspect(User).class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
 def generate_token(user_id):
     """Generate a JWT token for a user"""
     payload = {
@@ -37,8 +115,8 @@ def get_token_from_request():
         return auth_header[7:]  # Remove 'Bearer ' prefix
     return None
 
-def get_current_user():
-    """Get the current authenticated user"""
+def get_current_user_id():
+    """Get the user id from the request's token, without touching the database"""
     token = get_token_from_request()
     if not token:
         return None
@@ -47,11 +125,15 @@ def get_current_user():
     if not payload:
         return None
 
-    user_id = payload.get('user_id')
+    return payload.get('user_id')
+
+def get_current_user():
+    """Get the current authenticated user"""
+    user_id = get_current_user_id()
     if not user_id:
         return None
 
-    return User.query.get(user_id)
+    return load_user(user_id)
 
 
 def token_required(f):
@@ -75,6 +157,30 @@ def token_required(f):
     
     return decorated
 
+def claims_required(f):
+    """Decorator for routes that only need the caller's id.
+
+    The token alone authenticates the request, so no user is loaded;
+    ``current_user`` is a ``TokenUser`` carrying just the id.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        # ✅ Allow CORS preflight (OPTIONS) requests to pass
+        if request.method == "OPTIONS":
+            return '', 200
+
+        user_id = get_current_user_id()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'Unauthorized'
+            }), 401
+
+        kwargs['current_user'] = TokenUser(id=user_id)
+        return f(*args, **kwargs)
+
+    return decorated
+
 def admin_required(f):
     """Decorator to require an admin user for a route"""
     @wraps(f)
@@ -0,0 +1,136 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from utils.assets import PILImage, asset_store, sniff_format
+
+try:
+    from PIL import ImageOps
+except ImportError:  # Avatars are then stored as uploaded
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Avatar upload configuration
+AVATAR_MAX_BYTES = int(os.getenv('AVATAR_MAX_BYTES', 5 * 1024 * 1024))
+# Decoded size limit, so a small file cannot expand into a huge bitmap
+AVATAR_MAX_PIXELS = int(os.getenv('AVATAR_MAX_PIXELS', 40_000_000))
+# Square sizes rendered for each avatar; the largest is the profile's avatar_url
+AVATAR_SIZES = sorted(int(size) for size in os.getenv('AVATAR_SIZES', '64,128,256').split(',') if size.strip())
+AVATAR_WORKERS = int(os.getenv('AVATAR_WORKERS', 2))
+AVATAR_MAX_PENDING = int(os.getenv('AVATAR_MAX_PENDING', AVATAR_WORKERS * 4))
+
+ACCEPTED_FORMATS = {'PNG', 'JPEG', 'WEBP', 'GIF'}
+
+
+class AvatarBusy(Exception):
+    """Raised when the avatar pool already has ``max_pending`` uploads"""
+
+
+class AvatarStore:
+    """Validates uploaded avatars and stores them downscaled, off the request thread.
+
+    Each upload is decoded on a small thread pool, cropped to a square and
+    saved as WebP at every size in ``sizes`` under ``avatars/<user id>/``,
+    named by the upload's hash. Like password hashing, once ``max_pending``
+    uploads are in flight new ones raise ``AvatarBusy``. ``collect`` removes
+    a user's files that their profile no longer points at; hold
+    ``user_lock`` across an upload and its collection so overlapping
+    uploads cannot remove each other's files.
+    """
+
+    def __init__(self, storage=None, sizes=AVATAR_SIZES, workers=AVATAR_WORKERS, max_pending=AVATAR_MAX_PENDING):
+        self.storage = storage or asset_store.storage
+        self.sizes = sizes
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._pool = None
+        self._lock = threading.Lock()
+        self._user_locks = weakref.WeakValueDictionary()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='avatar-worker')
+            return self._pool
+
+    def user_lock(self, user_id):
+        """A reentrant lock serialising one user's avatar changes in this process"""
+        with self._lock:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.RLock()
+            return lock
+
+    def prefix(self, user_id):
+        return f'avatars/{user_id}'
+
+    def save(self, user_id, stream):
+        """Store the image in the file-like ``stream``; returns its URL.
+
+        Raises ``ValueError`` if it is not an acceptable image.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise AvatarBusy('Too many avatar uploads in progress')
+        try:
+            return self._get_pool().submit(self._save, user_id, stream).result()
+        finally:
+            self._slots.release()
+
+    def _save(self, user_id, stream):
+        digest = hashlib.file_digest(stream, 'sha256').hexdigest()[:16]
+        stream.seek(0)
+        prefix = self.prefix(user_id)
+
+        if PILImage is None or ImageOps is None:
+            data = stream.read(AVATAR_MAX_BYTES + 1)
+            fmt = sniff_format(data)
+            if fmt is None or len(data) > AVATAR_MAX_BYTES:
+                raise ValueError('Avatar must be a PNG, JPEG or WebP image')
+            name = f'{prefix}/{digest}.{fmt}'
+            self.storage.write(name, data)
+            return self.storage.url(name)
+
+        largest = self.sizes[-1]
+        try:
+            with PILImage.open(stream) as image:
+                if image.format not in ACCEPTED_FORMATS:
+                    raise ValueError('Avatar must be a PNG, JPEG, WebP or GIF image')
+                if image.width * image.height > AVATAR_MAX_PIXELS:
+                    raise ValueError('Avatar dimensions are too large')
+                # JPEGs can be decoded at a fraction of their size
+                image.draft('RGB', (largest, largest))
+                image = ImageOps.exif_transpose(image)
+                alpha = 'A' in image.getbands() or 'transparency' in image.info
+                image = ImageOps.fit(image.convert('RGBA' if alpha else 'RGB'), (largest, largest), PILImage.LANCZOS)
+        except (OSError, SyntaxError, PILImage.DecompressionBombError) as e:
+            raise ValueError('Avatar is not a valid image') from e
+
+        for size in reversed(self.sizes):
+            if size != image.width:
+                image = image.resize((size, size), PILImage.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, 'WEBP', quality=85)
+            self.storage.write(f'{prefix}/{digest}-{size}.webp', buffer.getvalue())
+        return self.storage.url(f'{prefix}/{digest}-{largest}.webp')
+
+    def collect(self, user_id, keep=None):
+        """Delete a user's stored avatars other than the one at URL ``keep``"""
+        prefix = self.prefix(user_id)
+        keep_digest = None
+        if keep and keep.startswith(self.storage.url(prefix + '/')):
+            keep_digest = keep.rsplit('/', 1)[1].split('-')[0].split('.')[0]
+
+        removed = 0
+        for name in self.storage.list(prefix):
+            if keep_digest is None or not name.rsplit('/', 1)[1].startswith(keep_digest):
+                self.storage.delete(name)
+                removed += 1
+        if removed:
+            logger.info('Removed %d superseded avatar files', removed, extra={'user_id': user_id})
+
+
+avatar_store = AvatarStore()
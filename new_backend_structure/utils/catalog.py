@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from models import db, Image
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'predefined_images.json')
+
+
+class PredefinedCatalog:
+    """The predefined image catalog, held in memory and seeded into ``images``.
+
+    Loaded once at startup from ``data/predefined_images.json`` (the same
+    entries the frontend ships in ``components/images.ts``). Every entry is
+    guaranteed a row in the images table, so saves only need the cached
+    image id.
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self.entries = []
+        self.body = b'[]'
+        self.etag = None
+        self._by_slug = {}
+        self._by_url = {}
+
+    def init_app(self, app):
+        with open(self.path, encoding='utf-8') as f:
+            entries = json.load(f)
+
+        with app.app_context():
+            image_ids = self._seed(entries)
+
+        # Serve the ids the rows actually have; an image saved before the
+        # catalog existed keeps the id it was created with
+        self.entries = [dict(entry, id=image_ids[entry['imageUrl']]) for entry in entries]
+        self._by_slug = {entry['slug']: entry for entry in self.entries}
+        self._by_url = {entry['imageUrl']: entry for entry in self.entries}
+
+        self.body = json.dumps({'success': True, 'images': self.entries}).encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()
+        logger.info('Loaded %d predefined images', len(self.entries))
+
+    def _seed(self, entries):
+        """Bulk insert missing catalog images and return their image_url -> id map"""
+        urls = [entry['imageUrl'] for entry in entries]
+        existing = dict(db.session.query(Image.image_url, Image.id).filter(Image.image_url.in_(urls)).all())
+
+        now = datetime.utcnow()
+        missing = [{
+            'id': entry['id'],
+            'image_url': entry['imageUrl'],
+            'prompt': entry['prompt'],
+            'created_at': now,
+            'updated_at': now
+        } for entry in entries if entry['imageUrl'] not in existing]
+
+        if missing:
+            try:
+                db.session.execute(insert(Image), missing)
+                db.session.commit()
+            except IntegrityError:
+                # Another process seeded the catalog at the same time
+                db.session.rollback()
+            existing = dict(db.session.query(Image.image_url, Image.id).filter(Image.image_url.in_(urls)).all())
+
+        return existing
+
+    def get(self, slug=None, image_url=None):
+        """Look up a catalog entry by slug or image URL"""
+        if slug:
+            return self._by_slug.get(slug)
+        return self._by_url.get(image_url)
+
+
+predefined_catalog = PredefinedCatalog()
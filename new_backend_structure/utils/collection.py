@@ -0,0 +1,47 @@
+import hashlib
+import json
+from flask import Response, request
+from sqlalchemy import func, select, update
+from models import db, User, UserImage
+
+# Each user has a collection version, bumped in the same transaction as any
+# change to what their gallery, images or profile return. Read responses
+# carry a weak ETag derived from it, so a client revalidating with
+# If-None-Match gets a 304 after a single primary-key lookup.
+
+def bump_collection_version(user_id=None, image_id=None):
+    """Bump the version of ``user_id``, or of every user who has ``image_id``"""
+    if user_id is not None:
+        condition = User.id == user_id
+    else:
+        condition = User.id.in_(select(UserImage.user_id).where(UserImage.image_id == image_id))
+
+    db.session.execute(
+        update(User)
+        .where(condition)
+        # Keep updated_at: it belongs to the profile, not the collection
+        .values(collection_version=func.coalesce(User.collection_version, 0) + 1, updated_at=User.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+def collection_version(user_id):
+    """A user's current collection version, without loading the user"""
+    return db.session.query(User.collection_version).filter(User.id == user_id).scalar() or 0
+
+def collection_etag(user_id, version, *parts):
+    """Opaque ETag for one user's view at ``version``; ``parts`` tell apart the responses of a route"""
+    raw = json.dumps([user_id, version, *parts], default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+def cache_validated(response, etag):
+    """Tag a response with a weak ETag that clients must revalidate before reuse"""
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag):
+    """A 304 response if the request's If-None-Match already has ``etag``, else None"""
+    if request.if_none_match.contains_weak(etag):
+        return cache_validated(Response(status=304), etag)
+    return None
@@ -0,0 +1,67 @@
+import gzip
+import os
+import time
+from flask import request
+from utils.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Responses smaller than this many bytes are sent as they are
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+# gzip level (1-9) and Brotli quality (0-11); low values keep it cheap per request
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'image/svg+xml',
+    'text/html', 'text/plain', 'text/css'
+}
+
+
+class Compression:
+    """Brotli or gzip for buffered text responses, negotiated on Accept-Encoding.
+
+    Streamed responses (the job event stream) and files sent by send_file
+    are left alone, as are partial and non-200 responses. Strong ETags are
+    weakened on compressed responses, since the bytes no longer match the
+    identity representation.
+    """
+
+    def __init__(self, min_size=COMPRESS_MIN_SIZE):
+        self.min_size = min_size
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def init_app(self, app):
+        # Registered last so it runs before the other after_request hooks,
+        # and its time shows up in Server-Timing
+        app.after_request(self._after_request)
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+        return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+    def _after_request(self, response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if not encoding or (response.content_length or 0) < self.min_size:
+            return response
+
+        start = time.perf_counter()
+        response.set_data(self.compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        metrics.record_timing('compress', time.perf_counter() - start)
+        return response
+
+
+compression = Compression()
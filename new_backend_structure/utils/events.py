@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+# How long a job's events are kept after its last update, in seconds
+EVENT_RETENTION = int(os.getenv('EVENT_RETENTION', 600))
+MAX_EVENTS_PER_JOB = int(os.getenv('MAX_EVENTS_PER_JOB', 500))
+
+
+class _Stream:
+    def __init__(self):
+        self.events = []
+        self.dropped = 0
+        self.updated = time.monotonic()
+
+
+class JobEvents:
+    """Recent progress events of each generation job, for SSE subscribers.
+
+    Producers (job workers, the fal.ai loop, the webhook) ``publish`` plain
+    dicts; subscribers ``wait`` for the events after a cursor, which is the
+    number of events they have already seen. Events only live in this
+    process's memory, so subscribers should fall back to the job row.
+    """
+
+    def __init__(self, retention=EVENT_RETENTION, max_events=MAX_EVENTS_PER_JOB):
+        self.retention = retention
+        self.max_events = max_events
+        self._streams = {}
+        self._condition = threading.Condition()
+
+    def publish(self, job_id, event):
+        with self._condition:
+            self._prune()
+            stream = self._streams.setdefault(job_id, _Stream())
+            stream.events.append(event)
+            stream.updated = time.monotonic()
+            # Keep the newest events; cursors count the dropped ones too
+            overflow = len(stream.events) - self.max_events
+            if overflow > 0:
+                del stream.events[:overflow]
+                stream.dropped += overflow
+            self._condition.notify_all()
+
+    def wait(self, job_id, cursor=0, timeout=None):
+        """Events after ``cursor``, waiting up to ``timeout`` for the first one.
+
+        Returns ``(events, next_cursor)``; ``events`` is empty on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                stream = self._streams.get(job_id)
+                if stream is not None:
+                    end = stream.dropped + len(stream.events)
+                    if cursor > end:
+                        # A cursor from before a restart; replay what we have
+                        cursor = 0
+                    if cursor < end:
+                        start = max(cursor - stream.dropped, 0)
+                        return stream.events[start:], end
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return [], cursor
+                self._condition.wait(remaining)
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention
+        for job_id in [job_id for job_id, stream in self._streams.items() if stream.updated < cutoff]:
+            del self._streams[job_id]
+
+
+job_events = JobEvents()
@@ -0,0 +1,147 @@
+# Shared fal.ai settings and helpers used by the generate route and the webhook
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import fal_client
+import requests
+from utils.async_loop import BackgroundLoop
+
+try:
+    import nacl.signing
+    import nacl.exceptions
+except ImportError:  # Webhook signatures cannot be checked, so webhooks are refused
+    nacl = None
+
+logger = logging.getLogger(__name__)
+
+FAL_MODEL = 'fal-ai/fast-lightning-sdxl'
+FAL_QUEUE_URL = 'https://queue.fal.run/'
+NEGATIVE_PROMPT = 'blurry, bad quality, distorted, disfigured'
+
+# fal.ai signs webhooks with ED25519 keys published here
+FAL_JWKS_URL = 'https://rest.alpha.fal.ai/.well-known/jwks.json'
+FAL_JWKS_MAX_AGE = 24 * 60 * 60
+# Webhooks signed further than this many seconds from now are refused
+FAL_WEBHOOK_TOLERANCE = 300
+# Set to false to accept unsigned webhooks, e.g. from a local tunnel in
+# development; the endpoint is then unauthenticated
+FAL_WEBHOOK_VERIFY = os.getenv('FAL_WEBHOOK_VERIFY', 'true').lower() == 'true'
+
+# One event loop for every fal.ai call, capped at FAL_MAX_CONCURRENCY in-flight requests
+fal_loop = BackgroundLoop(
+    max_concurrency=int(os.getenv('FAL_MAX_CONCURRENCY', 10)),
+    name='fal-loop'
+)
+
+_fal_client = None
+
+def get_fal_client():
+    """Shared fal.ai client, created on first use.
+
+    Only use it from coroutines running on ``fal_loop``: its HTTP connection
+    pool is bound to that loop and reused across generations.
+    """
+    global _fal_client
+    if _fal_client is None:
+        _fal_client = fal_client.AsyncClient(key=os.getenv('FAL_KEY'))
+    return _fal_client
+
+def build_arguments(prompt, seed=None, num_images=1):
+    """Request body for a fal.ai generation"""
+    arguments = {
+        "prompt": prompt,
+        "negative_prompt": NEGATIVE_PROMPT
+    }
+    if seed is not None:
+        arguments["seed"] = seed
+    if num_images > 1:
+        arguments["num_images"] = num_images
+    return arguments
+
+def generation_cache_key(prompt, seed=None, model=FAL_MODEL):
+    """Content address of a generation: normalized prompt, model, negative prompt and seed"""
+    normalized = ' '.join(prompt.lower().split())
+    raw = json.dumps([normalized, model, NEGATIVE_PROMPT, seed])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def extract_image_urls(result):
+    """Extract every image URL from a fal.ai result"""
+    # Try to extract the image URLs based on different possible formats
+    if isinstance(result, dict) and 'images' in result:
+        # Format: {'images': [{'url': '...'}]}
+        return [image.get('url') for image in result['images'] if image.get('url')]
+    elif hasattr(result, 'images'):
+        # Format: result.images[0].url
+        return [image.url for image in result.images if getattr(image, 'url', None)]
+    elif getattr(result, 'image_url', None):
+        # Format: result.image_url
+        return [result.image_url]
+    return []
+
+def extract_image_url(result):
+    """Extract the first image URL from a fal.ai result"""
+    image_urls = extract_image_urls(result)
+    return image_urls[0] if image_urls else None
+
+_jwks = {'keys': [], 'fetched_at': 0.0}
+_jwks_lock = threading.Lock()
+
+def webhook_public_keys():
+    """fal.ai's webhook verification keys, fetched at most once a day"""
+    with _jwks_lock:
+        if time.time() - _jwks['fetched_at'] > FAL_JWKS_MAX_AGE:
+            response = requests.get(FAL_JWKS_URL, timeout=10)
+            response.raise_for_status()
+            keys = []
+            for key in response.json().get('keys', []):
+                encoded = key.get('x', '')
+                keys.append(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            _jwks['keys'] = keys
+            _jwks['fetched_at'] = time.time()
+        return _jwks['keys']
+
+def verify_webhook_signature(headers, body):
+    """Whether a webhook delivery carries a valid fal.ai signature.
+
+    fal.ai signs the request id, its user id, the timestamp and the
+    SHA-256 of the body, one per line, and sends the hex ED25519
+    signature in X-Fal-Webhook-Signature.
+    """
+    if not FAL_WEBHOOK_VERIFY:
+        return True
+    if nacl is None:
+        logger.error('PyNaCl is not installed; refusing fal.ai webhook (set FAL_WEBHOOK_VERIFY=false to skip checks)')
+        return False
+
+    request_id = headers.get('X-Fal-Webhook-Request-Id')
+    user_id = headers.get('X-Fal-Webhook-User-Id')
+    timestamp = headers.get('X-Fal-Webhook-Timestamp')
+    signature = headers.get('X-Fal-Webhook-Signature')
+    if not (request_id and user_id and timestamp and signature):
+        return False
+
+    try:
+        if abs(time.time() - int(timestamp)) > FAL_WEBHOOK_TOLERANCE:
+            return False
+        signature = bytes.fromhex(signature)
+    except ValueError:
+        return False
+
+    message = '\n'.join([request_id, user_id, timestamp, hashlib.sha256(body).hexdigest()]).encode('utf-8')
+    try:
+        keys = webhook_public_keys()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning('Could not fetch fal.ai webhook keys: %s', e)
+        return False
+
+    for key in keys:
+        try:
+            nacl.signing.VerifyKey(key).verify(message, signature)
+            return True
+        except (nacl.exceptions.BadSignatureError, ValueError):
+            continue
+    return False
@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from utils.metrics import metrics
+
+# Password hashing configuration
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', os.cpu_count() or 1))
+HASH_MAX_PENDING = int(os.getenv('HASH_MAX_PENDING', HASH_WORKERS * 4))
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool already has ``max_pending`` jobs"""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """bcrypt hashing on a bounded pool of worker processes.
+
+    Keeps CPU-bound hashing off the request threads. Once ``max_pending``
+    hashes are queued or running, new calls raise ``HashingBusy`` instead of
+    piling up; the app turns that into a 429. ``workers=0`` hashes inline.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING, rounds=BCRYPT_ROUNDS):
+        self.workers = workers
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes now rather than on the first hash.
+
+        Call it before the process starts any thread, so the workers can be
+        forked safely; the app does this first thing.
+        """
+        if self.workers:
+            # With fork, the pool starts every worker on the first submit
+            self._get_pool().submit(int).result()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                if 'fork' in methods and threading.active_count() == 1:
+                    # fork keeps the workers from re-importing the app as __main__
+                    context = multiprocessing.get_context('fork')
+                else:
+                    # Forking once threads run can leave a worker holding a
+                    # lock (logging, malloc) that no thread will release
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _run(self, operation, func, *args):
+        if not self.workers:
+            start = time.perf_counter()
+            result = func(*args)
+            metrics.observe_hashing(operation, time.perf_counter() - start)
+            return result
+
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy('Too many password operations in progress')
+        try:
+            # Includes time queued for a worker, which is what a request waits
+            start = time.perf_counter()
+            result = self._get_pool().submit(func, *args).result()
+            metrics.observe_hashing(operation, time.perf_counter() - start)
+            return result
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run('hash', _hash, password, self.rounds)
+
+    def verify(self, password, hashed):
+        return self._run('verify', _verify, password, hashed)
+
+    def needs_rehash(self, hashed):
+        """Whether a hash was made with a different cost than the configured one"""
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,187 @@
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, GenerationJob, ImageRequest
+from utils.events import job_events
+from utils.log import correlation_id
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Persistent queue of image generation jobs drained by background workers.
+
+    Jobs live in the ``generation_jobs`` table, so nothing is lost when the
+    process restarts; the in-memory queue only hands job ids to the workers.
+    The worker pool is pluggable: pass a different ``thread_factory`` (or
+    subclass and override ``enqueue``) to run jobs somewhere else.
+
+    A sweeper thread periodically requeues jobs abandoned by a process
+    that died and calls ``sweep(cutoff)`` so work handed off out of band
+    (fal.ai webhooks) can be expired too.
+    """
+
+    def __init__(self, thread_factory=threading.Thread):
+        self.thread_factory = thread_factory
+        self.handler = None
+        self.stale_after = 300
+        self.sweep = None
+        self.app = None
+        self._queue = queue.Queue()
+        self._workers = []
+        self._stopping = threading.Event()
+        self._sweeper = None
+
+    def init_app(self, app, handler, stale_after=300, sweep=None, sweep_interval=60):
+        """Start the worker pool and requeue jobs left over from a previous run.
+
+        A job still ``running`` after ``stale_after`` seconds was abandoned
+        by a process that died; younger ones may belong to a live sibling
+        process and are left alone.
+        """
+        self.app = app
+        self.handler = handler
+        self.stale_after = stale_after
+        self.sweep = sweep
+
+        for i in range(app.config.get('GENERATION_WORKERS', 4)):
+            worker = self.thread_factory(target=self._work, name=f'generation-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        with app.app_context():
+            self.requeue_stale()
+
+        self._stopping.clear()
+        self._sweeper = self.thread_factory(
+            target=self._sweep, args=(sweep_interval,), name='generation-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def requeue_stale(self, all_queued=True):
+        """Requeue queued jobs and jobs abandoned while running; must run in an app context.
+
+        With ``all_queued`` false only queued jobs untouched for
+        ``stale_after`` seconds are enqueued, leaving alone the ones
+        waiting in a live process's queue.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        # Jobs already submitted to fal.ai finish through the webhook, not here
+        submitted = db.session.query(ImageRequest.job_id).filter(ImageRequest.job_id.isnot(None))
+        GenerationJob.query.filter(
+            GenerationJob.status == 'running',
+            GenerationJob.updated_at < cutoff,
+            GenerationJob.id.notin_(submitted)
+        ).update(
+            # Keep updated_at, so the job still counts as stale below
+            {'status': 'queued', 'updated_at': GenerationJob.updated_at},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        # Queued jobs may also sit in a sibling's queue; whichever worker
+        # claims one first runs it
+        pending = db.session.query(GenerationJob.id).filter(
+            GenerationJob.status == 'queued',
+            GenerationJob.id.notin_(submitted)
+        )
+        if not all_queued:
+            pending = pending.filter(GenerationJob.updated_at < cutoff)
+        pending = pending.order_by(GenerationJob.created_at).all()
+
+        for (job_id,) in pending:
+            self.enqueue(job_id)
+
+        if pending:
+            logger.info('Requeued %d pending generation jobs', len(pending))
+
+    def enqueue(self, job_id):
+        """Hand a committed job to the worker pool"""
+        job_events.publish(job_id, {'type': 'status', 'status': 'queued'})
+        self._queue.put(job_id)
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            # Log records for the job carry its id
+            token = correlation_id.set(job_id)
+            try:
+                with self.app.app_context():
+                    try:
+                        self._run(job_id)
+                    except Exception:
+                        # e.g. the database went away while claiming or
+                        # recording a failure; the job stays requeueable
+                        logger.exception('Generation worker error', extra={'job_id': job_id})
+                        db.session.rollback()
+            finally:
+                correlation_id.reset(token)
+                self._queue.task_done()
+
+    def _sweep(self, interval):
+        while not self._stopping.wait(interval):
+            cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+            with self.app.app_context():
+                try:
+                    self.requeue_stale(all_queued=False)
+                    if self.sweep is not None:
+                        self.sweep(cutoff)
+                except Exception:
+                    logger.exception('Generation sweep failed')
+                    db.session.rollback()
+
+    def _claim(self, job_id):
+        # Atomic queued -> running transition, so a job requeued by several
+        # processes is still only run once
+        claimed = GenerationJob.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'updated_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        return claimed == 1
+
+    def _run(self, job_id):
+        if not self._claim(job_id):
+            return
+        job_events.publish(job_id, {'type': 'status', 'status': 'running'})
+
+        job = GenerationJob.query.get(job_id)
+        try:
+            image_id = self.handler(job)
+            if image_id is not None:
+                job.image_id = image_id
+                job.status = 'done'
+            # A handler returning None has handed the job off to be completed
+            # out of band (the fal.ai webhook), so it stays running
+            db.session.commit()
+            if image_id is not None:
+                job_events.publish(job_id, {'type': 'status', 'status': 'done'})
+        except Exception as e:
+            logger.warning('Generation job failed: %s', e, extra={'job_id': job_id})
+            db.session.rollback()
+            job = GenerationJob.query.get(job_id)
+            job.status = 'failed'
+            if isinstance(e, SQLAlchemyError):
+                # Keep SQL and its parameters out of what the client sees
+                job.error = 'Could not save the generated image'
+            else:
+                job.error = str(e) or e.__class__.__name__
+            db.session.commit()
+            job_events.publish(job_id, {'type': 'status', 'status': 'failed'})
+
+
+job_queue = JobQueue()
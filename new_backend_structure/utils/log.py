@@ -0,0 +1,138 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from flask import g, request
+
+# Logging configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' or 'text'
+# Fraction of high-volume records (per-event provider logs) that are kept
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.1))
+
+# Correlation id of the request or job being handled on this thread/task
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'correlation_id'}
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamp records with the current correlation id"""
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with ``extra`` fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'correlation_id', None):
+            entry['correlation_id'] = record.correlation_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The stdlib version runs the formatter here, on the caller's thread;
+        # only merge the arguments and leave the formatting to the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonLogging:
+    """Logging that stays off the request path.
+
+    Records go onto an in-memory queue through a ``QueueHandler``; a
+    ``QueueListener`` thread formats them (JSON by default) and writes them
+    to stdout. Each request gets a correlation id, taken from the
+    ``X-Request-ID`` header or generated, that is attached to every record
+    and echoed back in the response.
+    """
+
+    def __init__(self, level=LOG_LEVEL, fmt=LOG_FORMAT):
+        self.level = level
+        self.format = fmt
+        self.listener = None
+
+    def init_app(self, app):
+        self.configure()
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def configure(self):
+        """Route the root logger through the queue; safe to call more than once"""
+        if self.listener is not None:
+            return
+
+        stream = logging.StreamHandler(sys.stdout)
+        if self.format == 'json':
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s'))
+
+        records = queue.SimpleQueue()
+        handler = _QueueHandler(records)
+        handler.addFilter(CorrelationFilter())
+
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(self.level)
+
+        self.listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        """Flush the queue and stop the listener thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def _before_request(self):
+        g.request_id = (request.headers.get('X-Request-ID') or uuid.uuid4().hex)[:64]
+        correlation_id.set(g.request_id)
+
+    def _after_request(self, response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+
+    def _teardown_request(self, exc):
+        # Threads are reused across requests; don't leak the id to the next one
+        correlation_id.set(None)
+
+
+def log_sampled(logger, level, msg, *args, rate=LOG_SAMPLE_RATE, **kwargs):
+    """Log only a ``rate`` fraction of calls; for records emitted per event"""
+    if logger.isEnabledFor(level) and random.random() < rate:
+        logger.log(level, msg, *args, **kwargs)
+
+
+json_logging = JsonLogging()
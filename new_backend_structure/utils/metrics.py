@@ -0,0 +1,221 @@
+import logging
+import os
+import threading
+import time
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Requests issuing more SQL statements than this are logged as likely N+1s
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 20))
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """A Prometheus counter with a fixed set of label names"""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in self._values.items()]
+
+
+class Gauge:
+    """A Prometheus gauge; ``collect`` returns {label values: value} when scraped"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=(), collect=None):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.collect:
+            values.update(self.collect())
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in values.items()]
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of label names"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            # [cumulative bucket counts, sum, count]
+            series = self._values.setdefault(key, [[0] * len(self.buckets), 0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", bound)])} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Metrics:
+    """Process-wide request, database and upstream metrics.
+
+    ``init_app`` times every request, counts the SQL statements it issues,
+    reports both in a ``Server-Timing`` header and serves everything in the
+    Prometheus text format at ``/metrics``. Other modules add timings with
+    ``observe_upstream``/``observe_hashing``; durations recorded on a request
+    thread also show up in that request's ``Server-Timing``.
+    """
+
+    def __init__(self, query_budget=QUERY_BUDGET):
+        self.query_budget = query_budget
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Time spent handling a request', ['endpoint', 'method', 'status'])
+        self.request_queries = Histogram(
+            'http_request_db_queries', 'SQL statements issued per request', ['endpoint'],
+            buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+        self.request_db_duration = Histogram(
+            'http_request_db_duration_seconds', 'Time spent in SQL per request', ['endpoint'])
+        self.budget_exceeded = Counter(
+            'http_request_query_budget_exceeded_total', 'Requests that issued more SQL statements than the budget', ['endpoint'])
+        self.query_duration = Histogram(
+            'db_query_duration_seconds', 'Time spent executing a SQL statement', [])
+        self.upstream_duration = Histogram(
+            'upstream_request_duration_seconds', 'Time spent waiting on an image provider', ['provider', 'outcome'])
+        self.hashing_duration = Histogram(
+            'password_hash_duration_seconds', 'Time spent hashing or verifying a password', ['operation'])
+        self._collectors = [
+            self.request_duration, self.request_queries, self.request_db_duration, self.budget_exceeded,
+            self.query_duration, self.upstream_duration, self.hashing_duration
+        ]
+
+    def register(self, collector):
+        """Add a Counter, Gauge or Histogram to /metrics"""
+        self._collectors.append(collector)
+        return collector
+
+    def init_app(self, app):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        self.query_duration.observe(elapsed)
+        if has_request_context() and 'timings' in g:
+            g.query_count += 1
+            self.record_timing('db', elapsed)
+
+    def _before_request(self):
+        g.request_start = time.perf_counter()
+        g.query_count = 0
+        g.timings = {}
+
+    def _after_request(self, response):
+        if 'request_start' not in g:
+            return response
+
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or 'unmatched'
+        db_time = g.timings.get('db', 0)
+        self.request_duration.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        self.request_queries.observe(g.query_count, endpoint=endpoint)
+        self.request_db_duration.observe(db_time, endpoint=endpoint)
+
+        if g.query_count > self.query_budget:
+            self.budget_exceeded.inc(endpoint=endpoint)
+            logger.warning('Query budget exceeded: %s %s issued %d SQL statements (budget %d)',
+                           request.method, request.path, g.query_count, self.query_budget)
+
+        timings = [f'app;dur={elapsed * 1000:.1f}', f'db;dur={db_time * 1000:.1f};desc="{g.query_count} queries"']
+        timings += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in g.timings.items() if name != 'db']
+        response.headers['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def record_timing(self, name, seconds):
+        """Add to the current request's Server-Timing entry ``name``, if on a request thread"""
+        if has_request_context() and 'timings' in g:
+            g.timings[name] = g.timings.get(name, 0) + seconds
+
+    def observe_upstream(self, provider, seconds, outcome='success'):
+        self.upstream_duration.observe(seconds, provider=provider, outcome=outcome)
+        self.record_timing('upstream', seconds)
+
+    def observe_hashing(self, operation, seconds):
+        self.hashing_duration.observe(seconds, operation=operation)
+        self.record_timing('bcrypt', seconds)
+
+    def render(self):
+        if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+
+        lines = []
+        for collector in self._collectors:
+            lines.append(f'# HELP {collector.name} {collector.description}')
+            lines.append(f'# TYPE {collector.name} {collector.kind}')
+            lines.extend(collector.samples())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
@@ -0,0 +1,134 @@
+import logging
+from sqlalchemy import delete, func, inspect, select, text, update
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, User, Image, UserImage, GenerationJob, ImageRequest
+
+logger = logging.getLogger(__name__)
+
+# db.create_all() only creates missing tables. These helpers bring tables
+# created by an older models.py up to date; they run from
+# `python init_db.py --migrate`, once per deploy, never at app startup,
+# and must run in an app context.
+
+def add_missing_columns():
+    """Add columns declared in models.py that existing tables are missing.
+
+    Columns are added as nullable with no server default, which is what
+    every column added after a table's creation has to be.
+    """
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+
+        present = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info('Added column %s.%s', table.name, column.name)
+            except SQLAlchemyError as e:
+                # Most likely another process added it first
+                logger.warning('Could not add column %s.%s: %s', table.name, column.name, e)
+
+def dedupe_image_urls():
+    """Merge images that share an image_url, so uix_images_image_url can be built.
+
+    The earliest row of each URL is kept. Links to the other rows move to
+    it; a user who had both keeps one link with the flags of either, and
+    their collection version is bumped since their image ids changed.
+    Jobs and webhook requests pointing at a removed row follow it too.
+    """
+    inspector = inspect(db.engine)
+    if 'images' not in inspector.get_table_names():
+        return
+    if any(index['name'] == 'uix_images_image_url' for index in inspector.get_indexes('images')):
+        return
+
+    with db.engine.begin() as conn:
+        urls = conn.execute(
+            select(Image.image_url).group_by(Image.image_url).having(func.count() > 1)
+        ).scalars().all()
+
+        for url in urls:
+            keep, *duplicates = conn.execute(
+                select(Image.id).where(Image.image_url == url).order_by(Image.created_at, Image.id)
+            ).scalars().all()
+
+            for duplicate in duplicates:
+                holders = select(UserImage.user_id).where(UserImage.image_id == duplicate)
+                conn.execute(
+                    update(User).where(User.id.in_(holders))
+                    .values(collection_version=func.coalesce(User.collection_version, 0) + 1, updated_at=User.updated_at)
+                )
+                for flag in (UserImage.is_loved, UserImage.is_saved):
+                    conn.execute(
+                        update(UserImage)
+                        .where(UserImage.image_id == keep, UserImage.user_id.in_(holders.where(flag.is_(True))))
+                        .values({flag: True})
+                    )
+                already_linked = select(UserImage.user_id).where(UserImage.image_id == keep)
+                conn.execute(delete(UserImage).where(
+                    UserImage.image_id == duplicate, UserImage.user_id.in_(already_linked)))
+                conn.execute(update(UserImage).where(UserImage.image_id == duplicate).values(image_id=keep))
+                conn.execute(update(GenerationJob).where(GenerationJob.image_id == duplicate).values(image_id=keep))
+                conn.execute(update(ImageRequest).where(ImageRequest.image_id == duplicate).values(image_id=keep))
+                conn.execute(delete(Image).where(Image.id == duplicate))
+
+            logger.info('Merged %d duplicate images of %s', len(duplicates), url)
+
+def create_missing_indexes():
+    """Create indexes declared in models.py that an existing database is missing.
+
+    On PostgreSQL they are built CONCURRENTLY, so writes to the table carry
+    on meanwhile; an invalid index left by an interrupted build is dropped
+    and rebuilt. A unique index that cannot be built is fatal: the upserts
+    relying on it would fail on every call.
+    """
+    concurrently = db.engine.dialect.name == 'postgresql'
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        invalid = set()
+        if concurrently:
+            invalid = set(conn.execute(text(
+                'SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid'
+            )).scalars())
+
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in invalid:
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index.name}'))
+                options = index.dialect_options['postgresql']
+                options['concurrently'] = concurrently
+                try:
+                    index.create(bind=conn, checkfirst=True)
+                except SQLAlchemyError as e:
+                    if index.unique:
+                        raise
+                    logger.warning('Could not create index %s: %s', index.name, e)
+                finally:
+                    options['concurrently'] = False
+
+def pending_migrations():
+    """Names of the columns and indexes in models.py the database is missing"""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        missing += [f'{table.name}.{column.name}' for column in table.columns if column.name not in columns]
+        missing += [index.name for index in table.indexes if index.name not in indexes]
+    return missing
+
+def migrate_schema():
+    add_missing_columns()
+    dedupe_image_urls()
+    create_missing_indexes()
@@ -0,0 +1,105 @@
+import logging
+import os
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from utils.metrics import Counter, Gauge, metrics
+
+logger = logging.getLogger(__name__)
+
+# Connection pool configuration. Neon closes idle connections after a few
+# minutes, so connections are recycled before that and pinged on checkout.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 240))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# Milliseconds before Postgres cancels a statement; 0 disables the limit
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+# Connecting through PgBouncer in transaction mode (e.g. Neon's -pooler host)
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``database_url``"""
+    if not database_url:
+        return {}
+
+    url = make_url(database_url)
+    if url.get_backend_name() != 'postgresql':
+        return {'pool_pre_ping': DB_POOL_PRE_PING}
+
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+
+    connect_args = {}
+    if DB_PGBOUNCER:
+        # PgBouncer rejects startup parameters and shares server connections
+        # between clients, so neither session settings nor server-side
+        # prepared statements survive; psycopg2 never prepares, psycopg 3
+        # has to be told not to
+        if url.get_driver_name() == 'psycopg':
+            connect_args['prepare_threshold'] = None
+    elif DB_STATEMENT_TIMEOUT_MS:
+        connect_args['options'] = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+class PoolMonitor:
+    """Pool utilisation for /metrics, and per-transaction timeouts behind PgBouncer"""
+
+    def __init__(self):
+        self.engine = None
+        self.connections_opened = metrics.register(Counter(
+            'db_pool_connections_opened_total', 'Database connections opened by the pool'))
+        self.connections_invalidated = metrics.register(Counter(
+            'db_pool_connections_invalidated_total', 'Pooled connections discarded as broken or stale'))
+        self.checkouts = metrics.register(Counter(
+            'db_pool_checkouts_total', 'Connections checked out of the pool'))
+        metrics.register(Gauge(
+            'db_pool_connections', 'Pooled connections by state', ['state'], collect=self._collect))
+
+    def init_app(self, app, db):
+        with app.app_context():
+            self.engine = db.engine
+
+        pool = self.engine.pool
+        event.listen(pool, 'connect', lambda *args: self.connections_opened.inc())
+        event.listen(pool, 'invalidate', lambda *args: self.connections_invalidated.inc())
+        event.listen(pool, 'soft_invalidate', lambda *args: self.connections_invalidated.inc())
+        event.listen(pool, 'checkout', lambda *args: self.checkouts.inc())
+
+        if DB_PGBOUNCER and DB_STATEMENT_TIMEOUT_MS and self.engine.dialect.name == 'postgresql':
+            # SET LOCAL lasts until the end of the transaction, so it never
+            # leaks to the next client of the server connection
+            @event.listens_for(self.engine, 'begin')
+            def set_statement_timeout(conn):
+                conn.exec_driver_sql(f'SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}')
+
+        logger.info('Database pool configured', extra={
+            'pool': type(pool).__name__,
+            'pool_size': getattr(pool, 'size', lambda: None)(),
+            'max_overflow': getattr(pool, '_max_overflow', None),
+            'pgbouncer': DB_PGBOUNCER
+        })
+
+    def _collect(self):
+        pool = self.engine.pool if self.engine is not None else None
+        if pool is None or not hasattr(pool, 'checkedout'):
+            return {}
+        return {
+            ('checked_out',): pool.checkedout(),
+            ('idle',): pool.checkedin(),
+            ('overflow',): max(pool.overflow(), 0),
+            ('capacity',): pool.size() + getattr(pool, '_max_overflow', 0)
+        }
+
+
+pool_monitor = PoolMonitor()
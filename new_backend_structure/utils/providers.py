@@ -0,0 +1,192 @@
+# Image generation backends. Every coroutine here runs on fal_loop.
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import struct
+import zlib
+from collections import namedtuple
+from dataclasses import dataclass, field
+from functools import lru_cache
+from utils.fal import FAL_MODEL, FAL_QUEUE_URL, build_arguments, extract_image_urls, get_fal_client
+
+logger = logging.getLogger(__name__)
+
+# Which provider generates images: 'fal' or 'local'
+IMAGE_PROVIDER = os.getenv('IMAGE_PROVIDER', 'fal')
+
+# Local provider behaviour; latency is in milliseconds
+LOCAL_LATENCY_MS = float(os.getenv('LOCAL_LATENCY_MS', 500))
+LOCAL_LATENCY_DISTRIBUTION = os.getenv('LOCAL_LATENCY_DISTRIBUTION', 'exponential')
+LOCAL_FAILURE_RATE = float(os.getenv('LOCAL_FAILURE_RATE', 0))
+LOCAL_RANDOM_SEED = int(os.getenv('LOCAL_RANDOM_SEED', 0))
+LOCAL_IMAGE_SIZE = int(os.getenv('LOCAL_IMAGE_SIZE', 64))
+LOCAL_IMAGE_URL = os.getenv('LOCAL_IMAGE_URL', '/api/images/local/')
+
+# Status updates, shaped like fal_client's Queued and InProgress
+Queued = namedtuple('Queued', ['position'])
+InProgress = namedtuple('InProgress', ['logs'])
+
+
+class ImageProvider:
+    """An image generation backend.
+
+    ``submit`` starts a generation and returns a handle, ``events`` iterates
+    its status updates (objects with ``position`` or ``logs``) and ``result``
+    returns the generated image URLs, raising if the generation failed.
+    """
+
+    name = None
+    model = None
+    supports_webhooks = False
+
+    def configuration_error(self):
+        """Why this provider cannot run, or None"""
+        return None
+
+    async def submit(self, prompt, seed=None, num_images=1):
+        raise NotImplementedError
+
+    def events(self, handle):
+        raise NotImplementedError
+
+    async def result(self, handle):
+        raise NotImplementedError
+
+    async def submit_webhook(self, prompt, webhook_url, seed=None):
+        """Queue a generation whose result is POSTed to ``webhook_url``; returns its request id"""
+        raise NotImplementedError(f'{self.name} does not support webhooks')
+
+
+class FalProvider(ImageProvider):
+    """fal.ai's queue API through the shared fal_client.AsyncClient"""
+
+    name = 'fal'
+    supports_webhooks = True
+
+    def __init__(self, model=FAL_MODEL):
+        self.model = model
+
+    def configuration_error(self):
+        if not os.getenv('FAL_KEY'):
+            return 'FAL_KEY environment variable is not set'
+        return None
+
+    async def submit(self, prompt, seed=None, num_images=1):
+        return await get_fal_client().submit(self.model, data=build_arguments(prompt, seed, num_images))
+
+    def events(self, handle):
+        return handle.iter_events(with_logs=True)
+
+    async def result(self, handle):
+        result = await handle.get()
+        logger.debug('Result received: %s', result)
+        return extract_image_urls(result)
+
+    async def submit_webhook(self, prompt, webhook_url, seed=None):
+        client = get_fal_client()
+        response = await client.client.post(
+            FAL_QUEUE_URL + self.model,
+            params={'fal_webhook': webhook_url},
+            json=build_arguments(prompt, seed),
+            timeout=client.default_timeout
+        )
+        response.raise_for_status()
+        return response.json()['request_id']
+
+
+@dataclass
+class LocalHandle:
+    tokens: list
+    latency: float
+    fails: bool
+    logs: list = field(default_factory=list)
+
+
+class LocalProvider(ImageProvider):
+    """A stand-in engine for load tests: no network, no cost.
+
+    Images are procedurally rendered PNGs served by ``/api/images/local``;
+    the URL's token is all that is needed to render one again. Seeded
+    generations always return the same images. Latency and failures are
+    drawn from a random generator seeded with ``random_seed``, so a run is
+    reproducible for the same sequence of calls.
+    """
+
+    name = 'local'
+    model = 'local/procedural'
+
+    def __init__(self, latency_ms=LOCAL_LATENCY_MS, distribution=LOCAL_LATENCY_DISTRIBUTION,
+                 failure_rate=LOCAL_FAILURE_RATE, random_seed=LOCAL_RANDOM_SEED):
+        if distribution not in ('fixed', 'uniform', 'exponential'):
+            raise ValueError(f'Unknown latency distribution: {distribution}')
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.failure_rate = failure_rate
+        self._random = random.Random(random_seed)
+
+    def _latency(self):
+        if self.distribution == 'fixed' or not self.latency_ms:
+            return self.latency_ms / 1000
+        if self.distribution == 'uniform':
+            return self._random.uniform(0, 2 * self.latency_ms) / 1000
+        return self._random.expovariate(1 / self.latency_ms) / 1000
+
+    async def submit(self, prompt, seed=None, num_images=1):
+        if seed is None:
+            tokens = ['%032x' % self._random.getrandbits(128) for _ in range(num_images)]
+        else:
+            tokens = [
+                hashlib.sha256(f'{prompt}\0{seed}\0{i}'.encode('utf-8')).hexdigest()[:32]
+                for i in range(num_images)
+            ]
+        return LocalHandle(tokens, self._latency(), self._random.random() < self.failure_rate)
+
+    async def events(self, handle):
+        yield Queued(position=0)
+        for step in range(2):
+            await asyncio.sleep(handle.latency / 2)
+            handle.logs.append({'message': f'Rendering step {step + 1}/2', 'timestamp': str(step)})
+            yield InProgress(logs=list(handle.logs))
+
+    async def result(self, handle):
+        if handle.fails:
+            raise RuntimeError('Local provider simulated a failure')
+        return [f'{LOCAL_IMAGE_URL}{token}.png' for token in handle.tokens]
+
+
+@lru_cache(maxsize=256)
+def render_png(token, size=LOCAL_IMAGE_SIZE):
+    """A PNG drawn from a local provider token: a two-colour gradient with a stripe pattern"""
+    digest = hashlib.sha256(token.encode('ascii')).digest()
+    start, end, stripe = digest[0:3], digest[3:6], digest[6] % 8 + 4
+
+    rows = []
+    for y in range(size):
+        row = bytearray(b'\x00')  # no filter
+        for x in range(size):
+            t = (x + y) / (2 * size - 2 or 1)
+            dim = 0.8 if (x // stripe + y // stripe) % 2 else 1.0
+            row += bytes(int((a + (b - a) * t) * dim) for a, b in zip(start, end))
+        rows.append(bytes(row))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)  # 8-bit RGB
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(b''.join(rows))) + chunk(b'IEND', b''))
+
+
+_provider = None
+
+def get_provider():
+    """The configured provider, created on first use"""
+    global _provider
+    if _provider is None:
+        providers = {'fal': FalProvider, 'local': LocalProvider}
+        if IMAGE_PROVIDER not in providers:
+            raise ValueError(f'Unknown IMAGE_PROVIDER: {IMAGE_PROVIDER}')
+        _provider = providers[IMAGE_PROVIDER]()
+    return _provider
@@ -0,0 +1,101 @@
+import os
+import time
+from functools import wraps
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from utils.metrics import Counter, metrics
+
+# Read replica configuration
+REPLICA_DATABASE_URL = os.getenv('REPLICA_DATABASE_URL')
+# How long a user's reads stay on the primary after they write, in seconds
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+REPLICA_BIND = 'replica'
+# Set on responses to requests that wrote, as a Unix time; clients echo it
+# back so their reads stay on the primary until then, whichever process
+# serves them
+STICKY_HEADER = 'X-Primary-Until'
+
+session_routes = metrics.register(Counter(
+    'db_session_routes_total', 'Statements routed by the session, by target', ['target']))
+
+
+def primary_requested():
+    """Whether the request carries a read-your-writes deadline that has not passed"""
+    try:
+        until = float(request.headers.get(STICKY_HEADER, 0))
+    except ValueError:
+        return False
+    # Deadlines further out than we hand out are not honoured
+    now = time.time()
+    return now < until <= now + replica_router.sticky_seconds
+
+
+def stick_to_primary():
+    """Send this client's reads to the primary for a while, as if the request had written.
+
+    For requests that observe a write made elsewhere, e.g. a status poll
+    seeing a generation job finish on a worker.
+    """
+    g.db_sticky = True
+
+
+class RoutingSession(Session):
+    """Sends the reads of ``read_only`` requests to the replica bind.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary,
+    as do the reads of clients still within a STICKY_HEADER deadline, and
+    everything when no replica is configured.
+    """
+
+    def reads_from_replica(self):
+        """Whether this request's reads go to the replica, and so may be stale"""
+        return (has_request_context() and g.get('read_only')
+                and REPLICA_BIND in self._db.engines and not primary_requested())
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            writing = self._flushing or getattr(clause, 'is_dml', False)
+            if writing:
+                g.db_wrote = True
+            elif self.reads_from_replica():
+                session_routes.inc(target='replica')
+                return self._db.engines[REPLICA_BIND]
+        session_routes.inc(target='primary')
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """Adds the replica bind and tells clients that just wrote to read from the primary"""
+
+    def __init__(self, url=REPLICA_DATABASE_URL, sticky_seconds=REPLICA_STICKY_SECONDS):
+        self.url = url
+        self.sticky_seconds = sticky_seconds
+
+    def init_app(self, app):
+        """Call before db.init_app so the bind exists when engines are created"""
+        if self.url:
+            app.config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA_BIND] = self.url
+        app.after_request(self._after_request)
+
+    def _after_request(self, response):
+        if g.get('db_wrote') or g.get('db_sticky'):
+            response.headers[STICKY_HEADER] = f'{time.time() + self.sticky_seconds:.3f}'
+        return response
+
+
+replica_router = ReplicaRouter()
+
+
+def read_only(f):
+    """Decorator for routes whose queries may be served by the replica.
+
+    Goes above ``token_required``/``claims_required`` so loading the user
+    is routed too.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.read_only = True
+        return f(*args, **kwargs)
+
+    return decorated
@@ -0,0 +1,34 @@
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db
+
+# INSERT ... ON CONFLICT builders for the dialects we run on
+_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+def upsert(model, values, conflict_columns, update_columns=None, extra_updates=None, returning=None):
+    """Insert a row, or update it in place if it collides on ``conflict_columns``.
+
+    Runs as a single ``INSERT ... ON CONFLICT DO UPDATE ... RETURNING``
+    statement in the current session, so concurrent callers never see a
+    unique violation. ``update_columns`` take their value from the row that
+    was being inserted; with none given the conflict columns are rewritten
+    to themselves, which still lets ``RETURNING`` hand back the existing row.
+
+    ``values`` may also be a list of rows, upserted by one multi-row
+    statement; the rows must not collide with each other.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in _INSERTS:
+        raise NotImplementedError(f'Upsert is not supported on {dialect}')
+
+    stmt = _INSERTS[dialect](model)
+    stmt = stmt.values(values) if isinstance(values, list) else stmt.values(**values)
+    set_ = {column: stmt.excluded[column] for column in (update_columns or conflict_columns)}
+    set_.update(extra_updates or {})
+    stmt = stmt.on_conflict_do_update(index_elements=conflict_columns, set_=set_)
+
+    if returning is not None:
+        stmt = stmt.returning(*returning)
+    return db.session.execute(stmt)